@@ -0,0 +1,41 @@
+"""
+throughput of the /transactions query against the number of concurrent clients, each running on its own
+thread the way FastAPI runs the sync endpoints, and drawing connections from the Database pool
+
+needs a database with some transactions imported
+
+run from the backend directory with: python -m benchmarks.bench_concurrent_requests
+"""
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import cfg
+from src.database import Database
+
+
+def client(db: Database, categories: list[str | None], deadline: float, seed: int) -> int:
+    rng = random.Random(seed)
+    requests = 0
+    while time.perf_counter() < deadline:
+        start_date = datetime.date(2022, 1, 1) + datetime.timedelta(days=rng.randint(0, 600))
+        end_date = start_date + datetime.timedelta(days=rng.randint(30, 365))
+        db.get_transactions_for_category(rng.choice(categories), start_date, end_date)
+        requests += 1
+    return requests
+
+
+if __name__ == "__main__":
+    duration = 5.0
+    db = Database(cfg.settings.pg_connection_uri)
+    categories: list[str | None] = [row["id"] for row in db.get_categories()] + [None]
+
+    print(f"pool size {cfg.settings.pg_pool_size}, max overflow {cfg.settings.pg_max_overflow}")
+    print(f"{'clients':>7} {'requests/s':>11}")
+    for clients in [1, 2, 4, 8, 16]:
+        deadline = time.perf_counter() + duration
+        with ThreadPoolExecutor(clients) as executor:
+            futures = [executor.submit(client, db, categories, deadline, seed) for seed in range(clients)]
+            requests = sum(future.result() for future in futures)
+        print(f"{clients:>7} {requests / duration:>11.0f}")
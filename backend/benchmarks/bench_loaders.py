@@ -0,0 +1,35 @@
+"""
+time spent in the database by each import loader, on rows that have already been parsed - both for a fresh
+import, and for reimporting the same rows, which are then all duplicates
+
+drops and recreates the tables of pg_test_connection_uri
+
+run from the backend directory with: python -m benchmarks.bench_loaders statement.csv
+"""
+import sys
+import time
+
+from src import cfg
+from src.database import Database
+
+if __name__ == "__main__":
+    if cfg.settings.pg_test_connection_uri is None:
+        sys.exit("pg_test_connection_uri is not set")
+    db = Database(cfg.settings.pg_test_connection_uri)
+    chunks = [Database.process_records(chunk)
+              for chunk in Database.read_records(sys.argv[1], chunksize=cfg.settings.import_chunksize)]
+    rows = sum(len(df) for df in chunks)
+
+    print(f"{rows} rows")
+    print(f"{'loader':<7} {'import':<9} {'inserted':>9} {'rows/s':>9}")
+    for loader in ["insert", "copy"]:
+        db.drop_all()
+        db.initialise_empty_tables()
+        for name in ["fresh", "reimport"]:
+            start = time.perf_counter()
+            inserted = 0
+            for df in chunks:
+                with db.engine.begin() as conn:
+                    inserted += db._insert_records(conn, df.copy(), loader).rows
+            seconds = time.perf_counter() - start
+            print(f"{loader:<7} {name:<9} {inserted:>9} {rows / seconds:>9.0f}")
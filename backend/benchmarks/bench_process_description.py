@@ -0,0 +1,70 @@
+"""
+per-row throughput of the description rules against the number of rules,
+comparing the compiled DescriptionMatcher with checking each rule in turn
+
+run from the backend directory with: python -m benchmarks.bench_process_description
+"""
+import random
+import re
+import time
+
+from benchmarks.common import random_word
+from src.matching import DescriptionMatcher
+
+
+def make_rules(n: int, rng: random.Random):
+    # split the rules between the rule types in roughly the proportions of _DescRules
+    display_name_dict = {f"{random_word(rng)} {random_word(rng)}": random_word(rng) for _ in range(n * 4 // 10)}
+    starts_with_set = {random_word(rng).title() for _ in range(n * 4 // 10)}
+    starts_with_dict = {random_word(rng): random_word(rng) for _ in range(n // 10)}
+    regex_dict = {fr"Direct Credit [0-9]+ {random_word(rng)}": random_word(rng) for _ in range(n // 10)}
+    return display_name_dict, starts_with_set, starts_with_dict, regex_dict
+
+
+def match_loop(desc: str, display_name_dict, starts_with_set, starts_with_dict, regex_dict) -> str | None:
+    """the original rule by rule implementation of Database.process_description"""
+    if desc in display_name_dict:
+        return display_name_dict[desc]
+    for s in starts_with_set:
+        if desc.lower().startswith(s.lower()):
+            return s
+    for k, v in starts_with_dict.items():
+        if desc.lower().startswith(k.lower()):
+            return v
+    for k, v in regex_dict.items():
+        if re.search(k, desc, flags=re.IGNORECASE):
+            return v
+    return None
+
+
+def make_descriptions(rules, n: int, rng: random.Random) -> list[str]:
+    display_name_dict, starts_with_set, starts_with_dict, regex_dict = rules
+    prefixes = list(display_name_dict) + list(starts_with_set) + list(starts_with_dict)
+    descriptions = []
+    for _ in range(n):
+        # about half of real descriptions match no rule at all
+        if rng.random() < 0.5:
+            descriptions.append(f"{random_word(rng)} {random_word(rng)} SYDNEY NS AUS")
+        else:
+            descriptions.append(f"{rng.choice(prefixes)} {rng.randint(0, 9999)}")
+    return descriptions
+
+
+def rows_per_sec(f, descriptions: list[str]) -> float:
+    start = time.perf_counter()
+    for desc in descriptions:
+        f(desc)
+    return len(descriptions) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    print(f"{'rules':>6} {'loop rows/s':>12} {'compiled rows/s':>16} {'speedup':>8}")
+    for rule_count in [10, 100, 1000, 5000]:
+        rules = make_rules(rule_count, rng)
+        descriptions = make_descriptions(rules, 2000, rng)
+        matcher = DescriptionMatcher(*rules)
+
+        loop = rows_per_sec(lambda desc: match_loop(desc, *rules), descriptions)
+        compiled = rows_per_sec(matcher.match, descriptions)
+        print(f"{rule_count:>6} {loop:>12.0f} {compiled:>16.0f} {compiled / loop:>7.1f}x")
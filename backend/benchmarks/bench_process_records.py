@@ -0,0 +1,70 @@
+"""
+throughput and peak memory of process_records on a synthetic statement (see generate_statement), 1M rows by default
+
+the "split" row is how process_records split off the card number and value date before, splitting each description
+three times and then replacing every NaN in the frame with None
+
+peak memory is of the Python heap, as traced by tracemalloc, which numpy and pandas allocations are reported to -
+it is measured on a separate run, as tracing slows everything down
+
+run from the backend directory with: python -m benchmarks.bench_process_records [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_statement import generate_statement
+from src.database import Database, DescriptionParse
+
+
+def process_records_split(records: pd.DataFrame) -> pd.DataFrame:
+    df = records.reset_index(drop=True)
+    df["description"] = df["description_original"]
+    desc = df["description"].str.split("Value Date: ").str.get(0)
+    value_date = df["description"].str.split("Value Date: ").str.get(1)
+
+    df["description"] = desc
+    df["value_date"] = pd.to_datetime(value_date, format="%d/%m/%Y")
+
+    df["description_raw"] = df["description"].str.split("Card xx").str.get(0)
+
+    codes, uniques = pd.factorize(df["description_raw"], use_na_sentinel=False)
+    parsed = Database.parse_descriptions(uniques.tolist())
+    for column in DescriptionParse._fields:
+        df[column] = np.asarray([getattr(parse, column) for parse in parsed], dtype=object)[codes]
+    return df.replace({np.nan: None})
+
+
+def measure(process: Callable[[pd.DataFrame], pd.DataFrame], records: pd.DataFrame) -> tuple[float, int]:
+    """
+    returns: the seconds taken, and the peak traced memory in bytes
+    """
+    start = time.perf_counter()
+    process(records)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    process(records)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as dir:
+        filename = os.path.join(dir, "statement.csv")
+        generate_statement(filename, rows)
+        records = Database.read_records(filename)
+
+    print(f"{rows} rows, {records['description_original'].nunique()} distinct descriptions")
+    print(f"{'implementation':<16} {'seconds':>8} {'rows/s':>9} {'peak MiB':>9}")
+    for name, process in [("split", process_records_split), ("process_records", Database.process_records)]:
+        seconds, peak = measure(process, records)
+        print(f"{name:<16} {seconds:>8.2f} {rows / seconds:>9.0f} {peak / 2**20:>9.0f}")
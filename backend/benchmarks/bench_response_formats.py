@@ -0,0 +1,41 @@
+"""
+payload size and encoding time of each /transactions response format, for a daily series spanning several years
+
+the "json (jsonable_encoder)" row is how the endpoint was encoded before, with FastAPI running jsonable_encoder
+over every dict and then json.dumps over the result
+
+run from the backend directory with: python -m benchmarks.bench_response_formats
+"""
+import datetime
+from typing import Callable
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.common import best_of
+from server import series_response
+from src.transactions import DailySeries, to_transactions
+
+
+def synthetic_series(years: int, seed: int = 0) -> DailySeries:
+    rng = np.random.default_rng(seed)
+    n = 365 * years
+    amounts = np.round(rng.normal(0, 50, n) * (rng.random(n) < 0.4), 2)
+    return DailySeries(datetime.date(2020, 1, 1), amounts)
+
+
+if __name__ == "__main__":
+    encoders: dict[str, Callable[[DailySeries], bytes]] = {
+        "json (jsonable_encoder)": lambda s: JSONResponse(jsonable_encoder(to_transactions(s))).body,
+        "json": lambda s: series_response(s, "json").body,
+        "columnar": lambda s: series_response(s, "columnar").body,
+        "binary": lambda s: series_response(s, "binary").body,
+    }
+
+    print(f"{'years':>5} {'format':<24} {'bytes':>9} {'ms':>8}")
+    for years in [1, 5, 20]:
+        series = synthetic_series(years)
+        for name, encode in encoders.items():
+            seconds, size = best_of(20, lambda: encode(series)), len(encode(series))
+            print(f"{years:>5} {name:<24} {size:>9} {seconds * 1000:>8.2f}")
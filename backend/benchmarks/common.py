@@ -0,0 +1,25 @@
+"""
+helpers shared by the benchmarks
+"""
+import random
+import string
+import time
+from typing import Callable
+
+
+def best_of(repeats: int, run: Callable[[], object], setup: Callable[[], object] | None = None) -> float:
+    """
+    returns: the fastest of repeats runs in seconds, calling setup untimed before each
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 10)))
@@ -0,0 +1,77 @@
+"""
+writes a synthetic bank statement csv in the CommBank export format - newest first, with columns
+date, amount, description, balance - using merchants from DescRules and suburbs from the suburb list
+
+run from the backend directory with: python -m benchmarks.generate_statement statement.csv 100000
+"""
+import datetime
+import random
+import re
+import sys
+
+from benchmarks.common import random_word
+from src.constants import Constants, DescRules
+
+STATES = ["NS", "NSW", "VIC", "VI", "QLD", "QL", "ACT", "WA", "TAS", "SA"]
+COUNTRIES = ["AU", "AUS", "AU AUS"]
+
+
+def make_merchants(rng: random.Random, unmatched: int = 2000) -> list[str]:
+    """
+    the part of each description that stays the same between visits - the merchant and its location - for
+    the merchants of every DescRules rule, followed by merchants that match no rule at all
+    """
+    merchants = list(DescRules.display_name_dict)
+    merchants += [f"{s.upper()} {rng.randint(1000, 9999)}" for s in DescRules.starts_with_set]
+    merchants += [f"{s.upper()} {random_word(rng)}" for s in DescRules.starts_with_dict]
+    merchants += [re.sub(r"\[0-9\]\+", str(rng.randint(100000, 999999)), pattern) + f" {rng.randint(10**9, 10**10)}"
+                  for pattern in DescRules.regex_dict]
+    merchants += [f"{random_word(rng)} {random_word(rng)}" for _ in range(unmatched)]
+    return [add_location(merchant, rng) for merchant in merchants]
+
+
+def add_location(merchant: str, rng: random.Random) -> str:
+    if rng.random() < 0.2:
+        return merchant
+    suburb = rng.choice(Constants.suburbs)
+    # the bank truncates long descriptions, which often cuts off the end of the suburb
+    if rng.random() < 0.2 and len(suburb) > 8:
+        suburb = suburb[:-rng.randint(1, 5)]
+    return f"{merchant} {suburb.upper()} {rng.choice(STATES)} {rng.choice(COUNTRIES)}"
+
+
+def make_description(merchant: str, date: datetime.date, rng: random.Random) -> str:
+    description = merchant
+    if rng.random() < 0.6:
+        description += f" Card xx{rng.randint(1000, 9999)}"
+    if rng.random() < 0.3:
+        value_date = date - datetime.timedelta(days=rng.randint(1, 3))
+        description += f" Value Date: {value_date.strftime('%d/%m/%Y')}"
+    return description
+
+
+def generate_statement(filename: str, n: int, seed: int = 0, end_date: datetime.date = datetime.date(2024, 12, 31),
+                       rows_per_day: int = 8):
+    """
+    writes n rows ending on end_date, about rows_per_day rows a day
+
+    merchants are chosen with a long tail, like real spending, so that a few merchants - mostly those with
+    rules - make up most rows
+    """
+    rng = random.Random(seed)
+    merchants = make_merchants(rng)
+    weights = [1 / (i + 1) for i in range(len(merchants))]
+
+    balance = 10000.0
+    with open(filename, "w") as f:
+        for i, merchant in enumerate(rng.choices(merchants, weights, k=n)):
+            date = end_date - datetime.timedelta(days=i // rows_per_day)
+            amount = round(rng.uniform(-200, 60), 2)
+            description = make_description(merchant, date, rng)
+            f.write(f'{date.strftime("%d/%m/%Y")},"{amount:+.2f}","{description}","{balance:+.2f}"\n')
+            # going back in time, the balance before this transaction
+            balance = round(balance - amount, 2)
+
+
+if __name__ == "__main__":
+    generate_statement(sys.argv[1], int(sys.argv[2]))
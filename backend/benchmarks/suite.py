@@ -0,0 +1,106 @@
+"""
+times the import and query paths on synthetic statements (see generate_statement) of each size, and saves the
+results to benchmarks/results/<commit>.json so that they can be compared across commits
+
+add_records drops and recreates the tables of pg_test_connection_uri
+
+run from the backend directory with: python -m benchmarks.suite --sizes 10000 100000 1000000
+and to compare against an earlier run: python -m benchmarks.suite --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import best_of
+from benchmarks.generate_statement import generate_statement
+from src import cfg
+from src.database import Database
+from src.transactions import fill_days, get_transactions_averaged, get_transactions_smoothed, to_transactions
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+AVG_DAYS = 14
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_size(db: Database, filename: str, repeats: int) -> dict[str, float]:
+    originals = Database.read_records(filename)["description_original"].tolist()
+    # process_description is given descriptions with the suburb information already removed
+    descriptions = [Database.get_suburb_info(desc)[0] for desc in originals]
+    results = {
+        "get_suburb_info": best_of(repeats, lambda: [Database.get_suburb_info(desc) for desc in originals]),
+        "process_description": best_of(repeats, lambda: [Database.process_description(desc) for desc in descriptions]),
+        "process_records": best_of(repeats, lambda: Database.process_records(filename)),
+    }
+
+    def recreate():
+        db.drop_all()
+        db.initialise_empty_tables()
+
+    for loader in ["insert", "copy"]:
+        results[f"add_records ({loader})"] = best_of(
+            repeats, lambda: db.add_records(filename, cfg.settings.import_chunksize, loader), recreate)
+
+    raw = to_transactions(fill_days(db.get_transactions_for_category(), None, None))
+    results["get_transactions_raw"] = best_of(
+        repeats, lambda: to_transactions(fill_days(db.get_transactions_for_category(), None, None)))
+    results["get_transactions_averaged"] = best_of(repeats, lambda: get_transactions_averaged(raw, AVG_DAYS))
+    results["get_transactions_smoothed"] = best_of(repeats, lambda: get_transactions_smoothed(raw, AVG_DAYS))
+    return results
+
+
+def compare(previous: dict, current: dict):
+    print(f"{'benchmark':<40} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, seconds in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>10} {seconds:>10.4f} {'-':>7}")
+        else:
+            print(f"{name:<40} {before:>10.4f} {seconds:>10.4f} {seconds / before:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000], help="rows in each synthetic statement")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of each benchmark, of which the fastest is kept")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if cfg.settings.pg_test_connection_uri is None:
+        sys.exit("pg_test_connection_uri is not set")
+    db = Database(cfg.settings.pg_test_connection_uri)
+
+    # read before saving, which may replace the same file when comparing against a run at this commit
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as dir:
+        for size in args.sizes:
+            filename = os.path.join(dir, f"statement-{size}.csv")
+            generate_statement(filename, size)
+            for name, seconds in bench_size(db, filename, args.repeats).items():
+                results[f"{name} [{size}]"] = seconds
+                print(f"{name} [{size}]: {seconds:.4f}s")
+
+    current = {"commit": commit(), "date": datetime.datetime.now().isoformat(timespec="seconds"), "results": results}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = os.path.join(RESULTS_DIR, f"{current['commit']}.json")
+    with open(filename, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"saved to {filename}")
+
+    if previous is not None:
+        compare(previous, current)
@@ -1,11 +1,44 @@
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from src.transactions import get_transactions_averaged, get_transactions_raw, get_transactions_smoothed
-from src.database import DB
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from src.transactions import (STEP_DAYS, DailySeries, Resolution, SmoothingKernel, TransactionsTable, auto_resolution,
+                              average_amounts, downsample, get_daily_series_async, get_daily_series_sql_async,
+                              get_period_series_sql_async, get_transactions_table_async,
+                              period_series_from_prefix_sums, series_from_daily_matrix, series_from_prefix_sums,
+                              smooth_amounts, to_series, to_series_table, to_transactions)
+from src.database import ADB
+from src.cache import LRUCache, ResponseCache
+from src import cfg, metrics
+import asyncio
+import cProfile
 import datetime
+import io
+import pstats
+import time
 
-app = FastAPI()
+import numpy as np
+import orjson
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await ADB.engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+CACHE = ResponseCache(LRUCache(cfg.settings.response_cache_size,
+                               cfg.settings.response_cache_ttl))
+"""
+caches /transactions responses, both the raw daily series and the smoothed series
+
+every key starts with what it is of ("raw", "smoothed", "resolution", "date_bounds" or "by_category"), so that keys
+of different shapes never collide whatever the query parameters
+"""
 
 origins = [
     "http://localhost:5173"
@@ -18,29 +51,308 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+PROFILE_LOCK = asyncio.Lock()
+"""held while a ?profile request is profiled, as cProfile fails to enable a second profiler"""
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """
+    times every request, and the stages within it, which are returned in the Server-Timing header
+
+    if cfg.settings.profiling is on, a request with ?profile in its url gets a cProfile report instead of its response -
+    the profiler sees the whole event loop while the request is awaited, so the report includes whatever other requests
+    ran meanwhile, and profiled requests wait for each other as only one profiler can be enabled at a time
+    """
+    if cfg.settings.profiling and "profile" in request.query_params:
+        async with PROFILE_LOCK:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await timed_response(request, call_next)
+            finally:
+                profiler.disable()
+        return profile_response(profiler)
+    response, seconds, stages = await timed_response(request, call_next)
+    response.headers["Server-Timing"] = metrics.server_timing({**stages, "total": seconds})
+    return response
+
+
+async def timed_response(request: Request, call_next) -> tuple[Response, float, dict[str, float]]:
+    """
+    returns: the response to the request, with the seconds it took in total and in each stage, which are also recorded
+    in the request latency metric
+    """
+    start = time.perf_counter()
+    with metrics.collect_stages() as stages:
+        response = await call_next(request)
+    seconds = time.perf_counter() - start
+
+    # label by the route rather than the url, so that query strings and unknown urls do not each get their own series
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(seconds, request.method, route.path if route is not None else "",
+                                    str(response.status_code))
+    return response, seconds, stages
+
+
+def profile_response(profiler: cProfile.Profile, limit: int = 50) -> PlainTextResponse:
+    """
+    the limit functions with the most cumulative time
+    """
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return PlainTextResponse(report.getvalue())
+
+
+ResponseFormat = Literal["json", "columnar", "binary"]
+"""
+how the time series endpoints encode their response:
+- json: the default, one object per day (or a list of dates for /transactions/by_category)
+- columnar: the start date and step in days, then a dense list of amounts
+- binary: the amounts as raw little-endian float64, with the start date, step and categories in the headers
+"""
+
+
+def binary_response(start_date: datetime.date | None, amounts: list, categories: list[str | None] | None = None,
+                    resolution: Resolution = "day") -> Response:
+    """
+    amounts is either one series, or one series per category which are concatenated
+
+    X-Step-Days is left out for months and years, which have no fixed step
+    """
+    headers = {"X-Start-Date": start_date.isoformat() if start_date is not None else "",
+               "X-Resolution": resolution}
+    if STEP_DAYS[resolution] is not None:
+        headers["X-Step-Days"] = str(STEP_DAYS[resolution])
+    if categories is not None:
+        headers["X-Categories"] = orjson.dumps(categories).decode()
+    body = np.asarray(amounts, dtype="<f8").tobytes()
+    return Response(body, media_type="application/octet-stream", headers=headers)
+
+
+@metrics.timed("encode")
+def series_response(series: DailySeries, format: ResponseFormat) -> Response:
+    # returning a response directly skips FastAPI's jsonable_encoder, which is slow for thousands of dicts
+    match format:
+        case "json":
+            return ORJSONResponse(to_transactions(series))
+        case "columnar":
+            return ORJSONResponse(to_series(series))
+        case "binary":
+            return binary_response(series.start_date, series.amounts, resolution=series.resolution)
+
+
+@metrics.timed("encode")
+def table_response(table: TransactionsTable, format: ResponseFormat) -> Response:
+    match format:
+        case "json":
+            return ORJSONResponse(table)
+        case "columnar":
+            return ORJSONResponse(to_series_table(table))
+        case "binary":
+            series = to_series_table(table)
+            return binary_response(series["start_date"], series["amounts"], series["categories"])
+
+
+Execution = Literal["python", "sql", "index", "matrix"]
+"""
+where /transactions fills in the missing days and computes the "averaged" moving average, or without smoothing,
+the totals of each period at a coarser resolution:
+- python: the default, from the days that have transactions
+- sql: in the database, so that only the final series is sent back - which can be faster for long ranges
+- index: by slicing the prefix sums that add_records keeps up to date, without querying the transactions
+- matrix: the daily series is a slice of the daily matrix that add_records keeps up to date, memory mapped so that
+  every worker shares one copy - averaging, smoothing and coarser resolutions are then done as for python. The
+  data version is checked against the database at most once every cfg.settings.data_version_ttl seconds, and
+  otherwise read from the saved matrix, so that the database is seldom queried - responses lag an import that did
+  not save the matrix by at most that long, after which the matrix is rebuilt from the database
+"""
+
 
 @app.get("/categories")
-def get_categories():
-    categories = DB.get_categories()
-    return [row["id"] for row in categories.mappings()]
+async def get_categories():
+    categories = await ADB.get_categories()
+    return [row["id"] for row in categories]
+
+
+async def get_raw_series(data_version: int,
+                         category: str | None,
+                         start_date: datetime.date | None,
+                         end_date: datetime.date | None,
+                         execution: Execution) -> DailySeries:
+    """
+    the daily series before any smoothing, which is cached as every smoothing of it starts from it
+    """
+    raw_key = ("raw", category, start_date, end_date)
+    series = CACHE.get(data_version, raw_key)
+    if series is None:
+        match execution:
+            case "python":
+                series = await get_daily_series_async(category, start_date, end_date)
+            case "sql":
+                series = await get_daily_series_sql_async(category, start_date, end_date)
+            case "index":
+                prefix_sums = await ADB.get_prefix_sums(data_version)
+                series = series_from_prefix_sums(prefix_sums, category, start_date, end_date)
+            case "matrix":
+                daily_matrix = await ADB.get_daily_matrix(data_version)
+                series = series_from_daily_matrix(daily_matrix, category, start_date, end_date)
+        CACHE.set(data_version, raw_key, series)
+    return series
+
+
+async def get_smoothed_series(data_version: int,
+                              category: str | None,
+                              start_date: datetime.date | None,
+                              end_date: datetime.date | None,
+                              smoothing: str | None,
+                              avg_days: int,
+                              kernel: SmoothingKernel,
+                              execution: Execution) -> DailySeries:
+    """
+    the daily series with the smoothing applied
+    """
+    # every execution gives the same series, so they share cached responses
+    if smoothing is None:
+        return await get_raw_series(data_version, category, start_date, end_date, execution)
+
+    key = ("smoothed", category, start_date, end_date, smoothing, avg_days,
+           kernel if smoothing == "smoothed" else None)
+    result = CACHE.get(data_version, key)
+    if result is not None:
+        return result
+
+    match execution, smoothing:
+        case "sql", "averaged":
+            result = await get_daily_series_sql_async(category, start_date, end_date, avg_days)
+        case "index", "averaged":
+            prefix_sums = await ADB.get_prefix_sums(data_version)
+            result = series_from_prefix_sums(prefix_sums, category, start_date, end_date, avg_days)
+        case _, "averaged":
+            series = await get_raw_series(data_version, category, start_date, end_date, execution)
+            result = series._replace(amounts=average_amounts(series.amounts, avg_days))
+        case _, "smoothed":
+            series = await get_raw_series(data_version, category, start_date, end_date, execution)
+            result = series._replace(amounts=smooth_amounts(series.amounts, avg_days, kernel))
+    CACHE.set(data_version, key, result)
+    return result
+
+
+async def get_auto_resolution(data_version: int,
+                              category: str | None,
+                              start_date: datetime.date | None,
+                              end_date: datetime.date | None,
+                              points: int,
+                              execution: Execution) -> Resolution:
+    """
+    the finest resolution giving at most points amounts, where a missing start_date or end_date is taken from the data
+    """
+    if start_date is None or end_date is None:
+        key = ("date_bounds", category)
+        bounds = CACHE.get(data_version, key)
+        if bounds is None:
+            if execution == "matrix":
+                bounds = (await ADB.get_daily_matrix(data_version)).date_bounds(category)
+            else:
+                bounds = await ADB.get_date_bounds(category)
+            # caches no bounds as an empty tuple, as None is a miss
+            CACHE.set(data_version, key, bounds or ())
+        if not bounds:
+            return "day"
+        start_date = start_date if start_date is not None else bounds[0]
+        end_date = end_date if end_date is not None else bounds[1]
+    return auto_resolution(start_date, end_date, points)
 
 
 @app.get("/transactions")
-def get_transactions(category: str | None = None,
-                     start_date: datetime.date | None = None,
-                     end_date: datetime.date | None = None,
-                     smoothing: str | None = None,
-                     avg_days: int = 7):
-    transactions = get_transactions_raw(category, start_date, end_date)
-    match smoothing:
-        case None:
-            return transactions
-        case "averaged":
-            return get_transactions_averaged(transactions, avg_days)
-        case "smoothed":
-            return get_transactions_smoothed(transactions, avg_days)
+async def get_transactions(category: str | None = None,
+                           start_date: datetime.date | None = None,
+                           end_date: datetime.date | None = None,
+                           smoothing: str | None = None,
+                           avg_days: int = Query(7, ge=0),
+                           format: ResponseFormat = "json",
+                           execution: Execution = "python",
+                           resolution: Resolution | Literal["auto"] = "day",
+                           points: int = 1000,
+                           kernel: SmoothingKernel = "bump"):
+    """
+    kernel: the weights of the "smoothed" smoothing, see SmoothingKernel
+
+    resolution: "week", "month" or "year" give the average daily amount over each period rather than every day,
+    and "auto" the finest of them with at most points amounts - so that a long range costs no more than the chart
+    can show
+    """
+    if smoothing not in [None, "averaged", "smoothed"]:
+        return []
+
+    # responses only change when add_records imports something, which bumps the data version
+    if execution == "matrix":
+        data_version = await ADB.get_daily_matrix_version()
+    else:
+        data_version = await ADB.get_data_version()
+
+    if resolution == "auto":
+        resolution = await get_auto_resolution(data_version, category, start_date, end_date, points, execution)
+    if resolution == "day":
+        series = await get_smoothed_series(data_version, category, start_date, end_date, smoothing, avg_days,
+                                           kernel, execution)
+        return series_response(series, format)
+
+    key = ("resolution", category, start_date, end_date, smoothing, avg_days if smoothing is not None else None,
+           kernel if smoothing == "smoothed" else None, resolution)
+    result = CACHE.get(data_version, key)
+    if result is not None:
+        return series_response(result, format)
+
+    # without smoothing, the sql and index executions total each period without filling in every day
+    match execution, smoothing:
+        case "sql", None:
+            result = await get_period_series_sql_async(category, start_date, end_date, resolution)
+        case "index", None:
+            prefix_sums = await ADB.get_prefix_sums(data_version)
+            result = period_series_from_prefix_sums(prefix_sums, category, start_date, end_date, resolution)
         case _:
-            return []
+            series = await get_smoothed_series(data_version, category, start_date, end_date, smoothing, avg_days,
+                                               kernel, execution)
+            result = downsample(series, resolution)
+    CACHE.set(data_version, key, result)
+    return series_response(result, format)
+
+
+@app.get("/transactions/by_category")
+async def get_transactions_by_category(start_date: datetime.date | None = None,
+                                       end_date: datetime.date | None = None,
+                                       smoothing: str | None = None,
+                                       avg_days: int = Query(7, ge=0),
+                                       format: ResponseFormat = "json",
+                                       kernel: SmoothingKernel = "bump"):
+    """
+    the daily amounts of every category at once, from a single query, with every category smoothed together
+    """
+    if smoothing not in [None, "averaged", "smoothed"]:
+        return []
+
+    data_version = await ADB.get_data_version()
+    key = ("by_category", start_date, end_date, smoothing, avg_days if smoothing is not None else None,
+           kernel if smoothing == "smoothed" else None)
+    result = CACHE.get(data_version, key)
+    if result is None:
+        result = await get_transactions_table_async(start_date, end_date, smoothing, avg_days, kernel)
+        CACHE.set(data_version, key, result)
+    return table_response(result, format)
+
+
+@app.get("/cache")
+def get_cache_stats():
+    return CACHE.stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    request and stage latencies, and rows processed by each stage, for Prometheus to scrape
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
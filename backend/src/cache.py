@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Protocol
+
+
+class CacheBackend(Protocol):
+    """
+    somewhere to keep cached responses - LRUCache keeps them in memory, but anything
+    implementing these methods (e.g. a wrapper around redis) can be given to ResponseCache instead
+    """
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        returns: the value stored for key, or None if there is none
+        """
+        ...
+
+    def set(self, key: Hashable, value: Any):
+        ...
+
+    def clear(self):
+        ...
+
+    def __len__(self) -> int:
+        ...
+
+
+class LRUCache:
+    """
+    an in-memory cache that holds at most maxsize values, evicting the least recently used,
+    and that forgets values ttl seconds after they are set
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._values: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            expiry, value = item
+            if expiry < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._values[key] = time.monotonic() + self.ttl, value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class ResponseCache:
+    """
+    caches responses against the version of the data they were computed from
+
+    whenever a newer data version is seen everything cached is dropped, and the version is also
+    part of every key so that a response computed from older data is never returned
+
+    cached values are shared between requests, so must not be modified
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.data_version: int | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data_version: int, key: Hashable) -> Any | None:
+        """
+        returns: the value cached for key from the given data version, or None if there is none
+        """
+        if self.data_version is None or data_version > self.data_version:
+            self.backend.clear()
+            self.data_version = data_version
+
+        value = self.backend.get((data_version, key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, data_version: int, key: Hashable, value: Any):
+        """
+        caches value for key, unless the data has changed since the value was computed from data_version
+        """
+        if data_version == self.data_version:
+            self.backend.set((data_version, key), value)
+
+    def stats(self) -> dict[str, int | None]:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.backend),
+                "data_version": self.data_version}
@@ -1,34 +1,107 @@
+import gc
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+from typing import NamedTuple
+
 import pandas as pd
 
+from .matching import DescriptionMatcher, SuburbMatcher
+from src import cfg
+
+
+_SUBURB_CACHE_VERSION = 1
+"""bump whenever the way the suburb artifacts are derived changes, so that stale caches are rebuilt"""
+
+
+class _SuburbIndex(NamedTuple):
+    suburbs: list[str]
+    suburb_missing_set: set[str]
+    suburb_matcher: SuburbMatcher
+
+
+def _build_suburb_index(suburb_file: str) -> _SuburbIndex:
+    suburb_df = pd.read_csv(suburb_file, delimiter=";")
+    suburb_df = suburb_df[["Official Name Suburb", "Official Name State"]]
+    suburb_df["Official Name Suburb"] = suburb_df["Official Name Suburb"].str.extract(
+        r"([^\(\)]*)(?:\(.*\))?")
+    suburb_df["Official Name Suburb"] = suburb_df["Official Name Suburb"].str.strip()
+
+    suburbs = suburb_df["Official Name Suburb"].tolist()
+
+    # truncated suburbs
+    max_suburb_missing = 5
+    suburb_missing_set = set()
+    for s in suburbs:
+        for i in range(1, max_suburb_missing+1):
+            if len(s[:-i]) <= 3:
+                break
+            if s[:-i].endswith(" "):
+                break
+            if s[:-i].lower() in {"north", "south", "east", "west"}:
+                break
+            suburb_missing_set.add(s[:-i])
+
+    return _SuburbIndex(suburbs, suburb_missing_set, SuburbMatcher(suburbs, suburb_missing_set))
+
+
+def _file_digest(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _load_suburb_index(suburb_file: str, cache_dir: str, digest: str | None = None) -> _SuburbIndex:
+    """
+    loads the suburb index from the cache if it was built from the same suburb file, otherwise builds and caches it
+
+    digest: the _file_digest of suburb_file, if the caller already has it
+    """
+    if digest is None:
+        digest = _file_digest(suburb_file)
+    cache_file = os.path.join(
+        cache_dir, f"suburbs-v{_SUBURB_CACHE_VERSION}-{digest}.pickle")
+
+    try:
+        # the matcher is millions of small dicts, and the cyclic garbage collector
+        # would otherwise repeatedly traverse them while they are being unpickled
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    suburb_index = _build_suburb_index(suburb_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, so that other workers never read a partially written cache
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(suburb_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return suburb_index
+
 
 class _Constants:
-    def __init__(self, suburb_file: str):
-        suburb_df = pd.read_csv(suburb_file, delimiter=";")
-        suburb_df = suburb_df[["Official Name Suburb", "Official Name State"]]
-        suburb_df["Official Name Suburb"] = suburb_df["Official Name Suburb"].str.extract(
-            r"([^\(\)]*)(?:\(.*\))?")
-        suburb_df["Official Name Suburb"] = suburb_df["Official Name Suburb"].str.strip()
-
-        self.suburbs = suburb_df["Official Name Suburb"]
-
-        self.regex_suburb = "|".join(self.suburbs.sort_values(
-            key=lambda x: x.str.len(), ascending=False)).lower()
-        """a regex that matches any suburb in Australia"""
-
-        # truncated suburbs
-        max_suburb_missing = 5
-        self.suburb_missing_set = set()
-        for s in self.suburbs:
-            for i in range(1, max_suburb_missing+1):
-                if len(s[:-i]) <= 3:
-                    break
-                if s[:-i].endswith(" "):
-                    break
-                if s[:-i].lower() in {"north", "south", "east", "west"}:
-                    break
-                self.suburb_missing_set.add(s[:-i])
-        self.regex_suburb_truncated = "|".join(self.suburb_missing_set).lower()
-        """a regex that matches any suburb that is truncated by up to 5 characters"""
+    def __init__(self, suburb_file: str, cache_dir: str):
+        self.suburb_digest = _file_digest(suburb_file)
+        """identifies the suburb list, so that anything derived from it knows when it changes"""
+
+        suburb_index = _load_suburb_index(suburb_file, cache_dir, self.suburb_digest)
+
+        self.suburbs = suburb_index.suburbs
+
+        self.suburb_missing_set = suburb_index.suburb_missing_set
+        """every suburb truncated by up to 5 characters"""
+
+        self.suburb_matcher = suburb_index.suburb_matcher
+        """matches any suburb in Australia, or any suburb that is truncated by up to 5 characters"""
 
         self.regex_state = "|".join(
             ["nsw", "ns", "vic", "vi", "qld", "ql", "act", "ac", "nt", "wa", "tas", "ta", "sa"])
@@ -38,6 +111,7 @@ class _Constants:
 
         self.regex_post_suburb = fr"\s*({self.regex_state})?\s*({self.regex_state})?\s*({self.regex_country})?\s*({self.regex_country})\s*$"
         """a regex that matches what should come after the suburb in the description"""
+        self.pattern_post_suburb = re.compile(self.regex_post_suburb)
 
         self.category_dict = {
             "Youtube Premium": "shopping",
@@ -162,6 +236,31 @@ class _DescRules:
                            r"Direct Credit [0-9]+ Central Accounts Sam": "Usyd Scholarship",
                            r"Direct Credit [0-9]+ Mcare Benefits": "Medicare Rebate"}
 
+        self.matcher = DescriptionMatcher(self.display_name_dict,
+                                          self.starts_with_set,
+                                          self.starts_with_dict,
+                                          self.regex_dict)
+        """all of the above rules, compiled into a prefix trie and a single regex"""
 
-Constants = _Constants(suburb_file="georef-australia-state-suburb.csv")
+
+Constants = _Constants(suburb_file="georef-australia-state-suburb.csv",
+                       cache_dir=cfg.settings.cache_dir)
 DescRules = _DescRules()
+
+
+_PARSE_VERSION = 1
+"""bump whenever get_suburb_info or process_description change how they parse, so that cached parses are redone"""
+
+
+def _parse_rules_version(constants: _Constants, desc_rules: _DescRules) -> str:
+    """
+    a digest of everything that parsing a description depends on, which changes whenever the suburb list,
+    the description rules, or the parsing code change
+    """
+    rules = json.dumps([_PARSE_VERSION, _SUBURB_CACHE_VERSION, constants.suburb_digest, constants.regex_post_suburb,
+                        desc_rules.display_name_dict, sorted(desc_rules.starts_with_set),
+                        desc_rules.starts_with_dict, desc_rules.regex_dict])
+    return hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+
+PARSE_RULES_VERSION = _parse_rules_version(Constants, DescRules)
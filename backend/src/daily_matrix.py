@@ -0,0 +1,42 @@
+import datetime
+
+import numpy as np
+
+from .snapshot import DailySnapshot
+
+
+class DailyMatrix(DailySnapshot):
+    """
+    the amount on every day in every category as a dense matrix, so that the daily series of any category over any
+    range within it is a slice, without copying
+
+    values[i, j] is the amount on start + i of column j
+    """
+
+    kind = "daily-matrix"
+    dtype = np.float64
+
+    def _set(self, offsets: np.ndarray, columns: np.ndarray, amounts: np.ndarray):
+        self.values[offsets, columns] = amounts
+        changed = np.unique(offsets)
+        # amounts are in cents, so rounding gives the same total as the database sums exactly
+        self.values[changed, 0] = np.round(self.values[changed, 1:].sum(axis=1), 2)
+
+    def daily(self, category: str | None, start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+        """
+        the amount on every day from start_date to end_date inclusive - a read-only view of the matrix where the
+        range is within it, otherwise a copy padded with 0 for the days outside of it
+        """
+        column = self._column(category)
+        first, last = start_date.toordinal() - self.start, end_date.toordinal() - self.start
+        if column is not None and 0 <= first and last < len(self):
+            view = self.values[first:last + 1, column]
+            view.flags.writeable = False
+            return view
+
+        result = np.zeros(max(0, last - first + 1), dtype=np.float64)
+        # the part of the range that the matrix covers, if any
+        lo, hi = max(first, 0), min(last, len(self) - 1)
+        if column is not None and lo <= hi:
+            result[lo - first:hi - first + 1] = self.values[lo:hi + 1, column]
+        return result
@@ -1,22 +1,83 @@
+import asyncio
 import datetime
+import glob
+import io
+import itertools
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, Literal, NamedTuple, TypedDict
+
 import sqlalchemy as sql
 import sqlalchemy.sql.functions as func
 import sqlalchemy.dialects.postgresql as psql
+from sqlalchemy.ext.asyncio import create_async_engine
 import pandas as pd
 import numpy as np
-import re
-from .constants import Constants, DescRules
+from .constants import PARSE_RULES_VERSION, Constants, DescRules
+from .metrics import collect_stages, span, timed, timed_iter
+from .daily_matrix import DailyMatrix
+from .prefix_sums import PrefixSums
+from .snapshot import S, DailySnapshot, SnapshotCache
 from src import cfg
 
 
-class Database:
-    def __init__(self, url: str):
-        self.DATABASE_URL = url
-        self.engine = sql.create_engine(self.DATABASE_URL)
+class ImportStats(TypedDict):
+    rows: int
+    inserted: int
+    duplicates: int
+    """rows that were already in the database, or that repeated an earlier row of the import"""
+    seconds: float
+    rows_per_sec: float
+    stages: dict[str, float]
+    """seconds spent in each stage of the import, e.g. "import.process_records" - see src.metrics"""
 
-        self.metadata = sql.MetaData()
 
-        self.conn = self.engine.connect()
+class _Inserted(NamedTuple):
+    rows: int
+    dates: list[datetime.date]
+    """the days of the inserted rows"""
+    data_version: int | None
+    """the data version after the insert, or None if nothing was inserted and so the version was not increased"""
+
+
+Loader = Literal["insert", "copy"]
+
+DESCRIPTION_PARTS = re.compile(r"(?P<description_raw>[^CV]*(?:(?:C(?!ard xx)|V(?!alue Date: ))[^CV]*)*)"
+                               r"(?:Card xx[^V]*(?:V(?!alue Date: )[^V]*)*)?"
+                               r"(?:Value Date: (?P<value_date>[^V]*(?:V(?!alue Date: )[^V]*)*))?")
+"""
+splits a description_original into the description before any "Card xx" or "Value Date: " (description_raw), and
+the text after "Value Date: " up to any second one (value_date)
+
+each part is written as runs of characters that cannot start a marker, rather than as a lazy .*?, as re would
+otherwise try to match a marker at every character
+"""
+
+SNAPSHOTS: list[type[DailySnapshot]] = [PrefixSums, DailyMatrix]
+"""the snapshots of the rollup that add_records keeps up to date, saved in cfg.settings.cache_dir"""
+
+
+class DescriptionParse(NamedTuple):
+    """
+    what process_records makes of one description, once the value date and card number are split off
+    """
+    description: str
+    """the description without the suburb information"""
+    location: str | None
+    description_id: str
+    processed: bool
+
+
+class Schema:
+    """
+    the tables, and the queries that read them, shared by Database and AsyncDatabase
+    """
+
+    def __init__(self):
+        self.metadata = sql.MetaData()
 
         self.table_transaction = sql.Table(
             "transaction",
@@ -40,19 +101,258 @@ class Database:
             sql.Column("id", sql.VARCHAR, primary_key=True),
             sql.Column("processed", sql.Boolean),
             sql.Column("category_id", sql.VARCHAR,
-                       sql.ForeignKey("category.id"))
+                       sql.ForeignKey("category.id")),
+            sql.Index("ix_description_category_id", "category_id"),
         )
+        # every read filters and groups on this expression rather than on either column
+        sql.Index("ix_transaction_coalesce_date",
+                  func.coalesce(self.table_transaction.c["value_date"], self.table_transaction.c["date"]))
         self.table_category = sql.Table(
             "category",
             self.metadata,
             sql.Column("id", sql.VARCHAR, primary_key=True),
         )
+        self.table_daily_category = sql.Table(
+            "daily_category",
+            self.metadata,
+            sql.Column("date", sql.Date),
+            sql.Column("category_id", sql.VARCHAR,
+                       sql.ForeignKey("category.id")),
+            sql.Column("amount", sql.DECIMAL(12, 2)),
+        )
+        """
+        the total amount on each day (coalesce(value_date, date)) in each category, maintained by add_records
+        """
+        # a unique index, so that inserting a day twice fails rather than double counting - on the category with null
+        # (uncategorised) as '', so that it is unique too, which NULLS NOT DISTINCT would need Postgres 15 for
+        sql.Index("ux_daily_category_date_coalesce_category_id",
+                  self.table_daily_category.c["date"], func.coalesce(self.table_daily_category.c["category_id"], ""),
+                  unique=True)
+        self.table_description_parse = sql.Table(
+            "description_parse",
+            self.metadata,
+            sql.Column("raw", sql.VARCHAR, primary_key=True),
+            sql.Column("rules_version", sql.VARCHAR, primary_key=True),
+            sql.Column("description", sql.VARCHAR),
+            sql.Column("location", sql.VARCHAR),
+            sql.Column("description_id", sql.VARCHAR),
+            sql.Column("processed", sql.Boolean),
+        )
+        """
+        the DescriptionParse of every description imported so far, so that later imports need not parse them again
+
+        parses are only reused while their rules_version is constants.PARSE_RULES_VERSION
+        """
+        self.table_data_version = sql.Table(
+            "data_version",
+            self.metadata,
+            sql.Column("id", sql.Integer, primary_key=True),
+            sql.Column("version", sql.BigInteger, nullable=False),
+        )
+        """
+        a single row that add_records increments whenever it changes the data, so that caches know when to recompute
+        """
+
+    def select_daily_category(self, dates: list[datetime.date] | None = None) -> sql.Select:
+        """
+        the query that aggregates the transaction table into daily_category rows, for the given days or every day if dates is None
+        """
+        description = self.table_description
+        transaction = self.table_transaction
+
+        coalesce_date = func.coalesce(
+            transaction.c["value_date"], transaction.c["date"])
+        query = (
+            sql.select(
+                coalesce_date,
+                description.c["category_id"],
+                func.sum(transaction.c["amount"])
+            )
+            .select_from(
+                transaction.join(
+                    description, transaction.c["description_id"] == description.c["id"], isouter=True)
+            )
+            .group_by(coalesce_date, description.c["category_id"])
+        )
+        if dates is not None:
+            query = query.where(coalesce_date.in_(dates))
+        return query
+
+    def select_transactions_groupby(self,
+                                    start_date: datetime.date | None = None,
+                                    end_date: datetime.date | None = None) -> sql.Select:
+        """
+        the query run by get_transactions_groupby
+        """
+        daily = self.table_daily_category
+
+        query = sql.select(
+            daily.c["date"],
+            daily.c["category_id"],
+            daily.c["amount"]
+        )
+        if start_date is not None:
+            query = query.where(daily.c["date"] >= start_date)
+        if end_date is not None:
+            query = query.where(daily.c["date"] <= end_date)
+
+        return query.order_by(daily.c["date"].asc(), daily.c["category_id"].asc())
+
+    def select_transactions_for_category(self,
+                                         category: str | None = None,
+                                         start_date: datetime.date | None = None,
+                                         end_date: datetime.date | None = None) -> sql.Select:
+        """
+        the query run by get_transactions_for_category
+        """
+        daily = self.table_daily_category
+
+        query = sql.select(
+            daily.c["date"],
+            func.sum(daily.c["amount"]).label("amount")
+        )
+        if category is not None:
+            query = query.where(daily.c["category_id"] == category)
+        if start_date is not None:
+            query = query.where(daily.c["date"] >= start_date)
+        if end_date is not None:
+            query = query.where(daily.c["date"] <= end_date)
+
+        return (query
+                .group_by(daily.c["date"])
+                .order_by(daily.c["date"].asc()))
+
+    def select_transactions_series(self,
+                                   category: str | None = None,
+                                   start_date: datetime.date | None = None,
+                                   end_date: datetime.date | None = None,
+                                   avg_days: int | None = None) -> sql.Select:
+        """
+        the query run by get_transactions_series
+
+        joins the rows of select_transactions_for_category onto a calendar of every day, so that days without rows
+        have an amount of 0, and if avg_days is given replaces each amount by its moving average
+        """
+        daily = self.select_transactions_for_category(
+            category, start_date, end_date).cte("daily")
+
+        # a missing start_date or end_date is taken from the first or last row, and with no rows the calendar is empty
+        start = sql.literal(start_date, sql.Date) if start_date is not None else sql.select(
+            func.min(daily.c["date"])).scalar_subquery()
+        end = sql.literal(end_date, sql.Date) if end_date is not None else sql.select(
+            func.max(daily.c["date"])).scalar_subquery()
+        calendar = sql.select(
+            sql.cast(sql.func.generate_series(sql.cast(start, sql.DateTime),
+                                              sql.cast(end, sql.DateTime),
+                                              sql.text("interval '1 day'")), sql.Date).label("date")
+        ).cte("calendar")
+
+        amount = func.coalesce(daily.c["amount"], 0)
+        if avg_days is not None:
+            # the sum over the window divided by its full width, rather than AVG, so that days beyond either end
+            # count as 0 in the same way as average_amounts
+            amount = func.sum(amount).over(order_by=calendar.c["date"],
+                                           rows=(-avg_days, avg_days)) / (2 * avg_days + 1)
+
+        return (sql.select(calendar.c["date"], sql.cast(amount, sql.Float).label("amount"))
+                .select_from(calendar.join(daily, calendar.c["date"] == daily.c["date"], isouter=True))
+                .order_by(calendar.c["date"].asc()))
+
+    def select_transactions_buckets(self,
+                                    category: str | None = None,
+                                    start_date: datetime.date | None = None,
+                                    end_date: datetime.date | None = None,
+                                    resolution: str = "month") -> sql.Select:
+        """
+        the query run by get_transactions_buckets
+
+        groups the rows of select_transactions_for_category by the period (date_trunc) they fall in, so only one row
+        per period with any transactions is sent back
+        """
+        daily = self.table_daily_category
+        period = sql.cast(sql.func.date_trunc(resolution, sql.cast(daily.c["date"], sql.DateTime)), sql.Date)
+
+        query = sql.select(
+            period.label("date"),
+            sql.cast(func.sum(daily.c["amount"]), sql.Float).label("amount"),
+            func.min(daily.c["date"]).label("first"),
+            func.max(daily.c["date"]).label("last")
+        )
+        if category is not None:
+            query = query.where(daily.c["category_id"] == category)
+        if start_date is not None:
+            query = query.where(daily.c["date"] >= start_date)
+        if end_date is not None:
+            query = query.where(daily.c["date"] <= end_date)
+
+        return query.group_by(period).order_by(period.asc())
+
+    def select_date_bounds(self, category: str | None = None) -> sql.Select:
+        daily = self.table_daily_category
+        query = sql.select(func.min(daily.c["date"]).label("first"), func.max(daily.c["date"]).label("last"))
+        if category is not None:
+            query = query.where(daily.c["category_id"] == category)
+        return query
+
+    def select_categories(self) -> sql.Select:
+        category = self.table_category
+        return sql.select(category.c["id"]).select_from(category)
+
+    def select_data_version(self) -> sql.Select:
+        return sql.select(self.table_data_version.c["version"])
+
+
+class Database(Schema):
+    def __init__(self, url: str):
+        super().__init__()
+        self.DATABASE_URL = url
+        # every method checks out its own connection from the pool, so the server's
+        # threadpool can run requests concurrently rather than sharing one connection
+        self.engine = sql.create_engine(self.DATABASE_URL,
+                                        pool_size=cfg.settings.pg_pool_size,
+                                        max_overflow=cfg.settings.pg_max_overflow,
+                                        pool_timeout=cfg.settings.pg_pool_timeout,
+                                        pool_pre_ping=True)
+        self.snapshots = SnapshotCache(cfg.settings.cache_dir, url)
+
+        # where the copy loader streams rows before merging them in - temporary tables are never written to the
+        # WAL, and these are dropped when the transaction that creates them commits
+        staging_metadata = sql.MetaData()
+        self.table_transaction_staging = sql.Table(
+            "transaction_staging",
+            staging_metadata,
+            sql.Column("position", sql.Integer),
+            *[sql.Column(column.name, column.type) for column in self.table_transaction.columns
+              if column.name != "id"],
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
+        self.table_description_staging = sql.Table(
+            "description_staging",
+            staging_metadata,
+            *[sql.Column(column.name, column.type) for column in self.table_description.columns],
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
+        self.table_record_staging = sql.Table(
+            "record_staging",
+            staging_metadata,
+            sql.Column("position", sql.Integer),
+            sql.Column("date", sql.Date),
+            sql.Column("amount", sql.BigInteger),
+            sql.Column("balance", sql.BigInteger),
+            sql.Column("description_original", sql.VARCHAR),
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
+        """where _drop_imported streams the keys of rows read from a csv, to find those already in the database"""
 
     def __del__(self):
-        self.conn.close()
+        self.engine.dispose()
 
     def drop_all(self):
         self.metadata.drop_all(self.engine)
+        self._forget_snapshots()
 
     def initialise_empty_tables(self):
         """
@@ -66,9 +366,53 @@ class Database:
         if None in categories:
             categories.remove(None)
         categories_df = pd.DataFrame.from_dict({"id": list(categories)})
-        self.conn.execute(psql.insert(self.table_category).values(
-            categories_df.to_dict(orient="records")))
-        self.conn.commit()
+        with self.engine.begin() as conn:
+            conn.execute(psql.insert(self.table_category).values(
+                categories_df.to_dict(orient="records")))
+            conn.execute(psql.insert(self.table_data_version).values(
+                id=1, version=0))
+
+    def migrate(self):
+        """
+        brings a database created by an older version up to date, creating any missing tables and indexes, and
+        dropping the parses cached by older rules
+        """
+        self.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            # replaced by the unique ux_daily_category_date_coalesce_category_id
+            conn.execute(sql.text("DROP INDEX IF EXISTS ix_daily_category_date_category_id"))
+            conn.execute(sql.text("DROP INDEX IF EXISTS ux_daily_category_date_category_id"))
+            self.refresh_daily_category(conn)
+            # parses by older rules are never reused, see table_description_parse
+            conn.execute(sql.delete(self.table_description_parse).where(
+                self.table_description_parse.c["rules_version"] != PARSE_RULES_VERSION))
+            conn.execute(psql.insert(self.table_data_version).values(
+                id=1, version=0).on_conflict_do_nothing())
+        # create_all skips tables that already exist, along with their indexes - these are created after the
+        # refresh, so that the unique index of daily_category is built over a rollup without duplicates
+        for table in self.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+        self._forget_snapshots()
+
+    def refresh_daily_category(self, conn: sql.Connection, dates: list[datetime.date] | None = None):
+        """
+        recomputes the daily_category rollup for the given days from the transaction table, or for every day if dates is None
+
+        runs on conn without committing, so that the refresh is part of the caller's transaction
+        """
+        daily = self.table_daily_category
+        delete = sql.delete(daily)
+        if dates is not None:
+            delete = delete.where(daily.c["date"].in_(dates))
+
+        # the delete drops (date, category) pairs that no longer have any transactions, while the upsert leaves a
+        # row inserted by a concurrent refresh of the same days replaced rather than failing on the unique index
+        conn.execute(delete)
+        insert = psql.insert(daily).from_select(["date", "category_id", "amount"], self.select_daily_category(dates))
+        conn.execute(insert.on_conflict_do_update(
+            index_elements=[daily.c["date"], func.coalesce(daily.c["category_id"], "")],
+            set_={"amount": insert.excluded["amount"]}))
 
     @staticmethod
     def get_suburb_info(desc: str) -> tuple[str, str | None]:
@@ -82,14 +426,13 @@ class Database:
 
         def extract_suburb(y: str, i: int):
             # search for a suburb name
-            match = re.search(Constants.regex_suburb, y.lower())
+            match = Constants.suburb_matcher.search(y.lower())
             if match:
-                start_index = match.span()[0]
-                end_index = match.span()[1]
+                start_index, end_index = match
                 # once we find a suburb name, we need to check the part of the string after the suburb name - this should be the state e.g. NSW and/or country e.g. AUS
                 remainder = y[end_index:].lower()
-                match_remainder = re.search(
-                    "^" + Constants.regex_post_suburb, remainder)
+                match_remainder = Constants.pattern_post_suburb.match(
+                    remainder)
                 if match_remainder:
                     return desc[:i + start_index].strip(), y[start_index:].strip()
                 else:
@@ -104,14 +447,13 @@ class Database:
         # if suburb extraction failed, try to see if the suburb name was just truncated
         if result[1] is None:
             # first, search for the post-suburb text
-            match = re.search(Constants.regex_post_suburb, desc.lower())
+            match = Constants.pattern_post_suburb.search(desc.lower())
             # if found, search for any truncated suburbs at the end
             if match:
                 start_index = match.span()[0]
-                match_truncated = re.search(
-                    f"({Constants.regex_suburb_truncated})$", desc.lower()[:start_index].strip())
-                if match_truncated:
-                    i = match_truncated.span()[0]
+                i = Constants.suburb_matcher.search_truncated_suffix(
+                    desc.lower()[:start_index].strip())
+                if i is not None:
                     desc_trunc = desc[:i].strip()
                     location_trunc = desc[i:].strip()
                     return desc_trunc, location_trunc
@@ -119,134 +461,623 @@ class Database:
         return result
 
     @staticmethod
-    def process_records(filename: str) -> pd.DataFrame:
-        df = pd.read_csv(filename,
-                         names=["date", "amount",
-                                "description_original", "balance"],
-                         parse_dates=["date"],
-                         date_format="%d/%m/%Y")
+    def read_records(filename: str, chunksize: int | None = None) -> pd.DataFrame | Iterator[pd.DataFrame]:
+        """
+        reads a bank statement csv, or if chunksize is given, an iterator over chunks of chunksize rows
+        """
+        return pd.read_csv(filename,
+                           names=["date", "amount",
+                                  "description_original", "balance"],
+                           parse_dates=["date"],
+                           date_format="%d/%m/%Y",
+                           chunksize=chunksize)
+
+    @staticmethod
+    @timed("import.process_records", rows=len)
+    def process_records(records: str | pd.DataFrame, parses: dict[str, DescriptionParse] | None = None) -> pd.DataFrame:
+        """
+        records: the filename of a bank statement csv, or rows of one as returned by read_records
 
-        df["description"] = df["description_original"]
-        desc = df["description"].str.split("Value Date: ").str.get(0)
-        value_date = df["description"].str.split("Value Date: ").str.get(1)
+        parses: descriptions that have already been parsed, which are not parsed again
 
-        df["description"] = desc
-        df["value_date"] = pd.to_datetime(value_date, format="%d/%m/%Y")
+        each distinct description is only parsed once, however many rows share it
+        """
+        if isinstance(records, pd.DataFrame):
+            df = records.reset_index(drop=True)
+        else:
+            df = Database.read_records(records)
 
-        df["description"] = df["description"].str.split("Card xx").str.get(0)
+        # one match per row splits off both the card number and the value date
+        parts = [DESCRIPTION_PARTS.match(desc).groups() for desc in df["description_original"].tolist()]
+        raws = np.array([raw for raw, _ in parts], dtype=object)
+        df["value_date"] = pd.to_datetime(pd.Series([value_date for _, value_date in parts], dtype=object),
+                                          format="%d/%m/%Y")
+        df["description_raw"] = raws
+        del parts
 
-        # extract suburb location from description
-        result = df["description"].apply(
-            Database.get_suburb_info).apply(pd.Series)
-        df["description"] = result[0]
-        df["location"] = result[1]
+        # parse every distinct description, then give each row the parse of its description
+        codes, uniques = pd.factorize(raws, use_na_sentinel=False)
+        parsed = Database.parse_descriptions(uniques.tolist(), parses)
+        for i, column in enumerate(DescriptionParse._fields):
+            df[column] = np.array([parse[i] for parse in parsed], dtype=object)[codes]
 
-        df = df.replace({np.nan: None})
+        # missing value dates stay NaT until the rows are sent to the database
         return df
 
+    @staticmethod
+    def parse_descriptions(descriptions: list[str],
+                           parses: dict[str, DescriptionParse] | None = None) -> list[DescriptionParse]:
+        """
+        extracts the suburb information from each description, then works out the description id from the rest,
+        taking the parse from parses instead where it has one
+        """
+        result = []
+        for raw in descriptions:
+            parse = parses.get(raw) if parses is not None else None
+            if parse is None:
+                description, location = Database.get_suburb_info(raw)
+                description_id, processed = Database.process_description(description)
+                parse = DescriptionParse(description, location, description_id, processed)
+            result.append(parse)
+        return result
+
     @staticmethod
     def process_description(desc: str) -> tuple[str, bool]:
+        name = DescRules.matcher.match(desc)
+        if name is not None:
+            return name, True
 
-        if desc in DescRules.display_name_dict:
-            return DescRules.display_name_dict[desc], True
+        return desc.title(), False
 
-        for s in DescRules.starts_with_set:
-            if desc.lower().startswith(s.lower()):
-                return s, True
+    def add_records(self, csv_file: str, chunksize: int | None = None, loader: Loader | None = None) -> ImportStats:
+        """
+        imports a bank statement csv, chunksize rows at a time so that memory use does not grow with the file
 
-        for k, v in DescRules.starts_with_dict.items():
-            if desc.lower().startswith(k.lower()):
-                return v, True
+        chunksize defaults to cfg.settings.import_chunksize, and loader to cfg.settings.import_loader
+        """
+        if chunksize is None:
+            chunksize = cfg.settings.import_chunksize
 
-        for k, v in DescRules.regex_dict.items():
-            if re.search(k, desc, flags=re.IGNORECASE):
-                return v, True
+        start = time.perf_counter()
+        rows = 0
+        inserted = 0
+        with collect_stages() as stages:
+            parses = self._load_parses()
+            for chunk in timed_iter("import.read_records", Database.read_records(csv_file, chunksize=chunksize)):
+                rows += len(chunk)
+                chunk = self._drop_imported(chunk)
+                if len(chunk) == 0:
+                    continue
+                df = Database.process_records(chunk, parses)
+                # commmit changes once per chunk
+                with self.engine.begin() as conn:
+                    self._save_parses(conn, df, parses)
+                    result = self._insert_records(conn, df, loader)
+                if result.data_version is not None:
+                    self._extend_snapshots(result.dates, result.data_version)
+                inserted += result.rows
 
-        return desc.title(), False
+        return Database._import_stats(rows, inserted, time.perf_counter() - start, stages)
+
+    def import_files(self, paths: str | list[str], max_workers: int | None = None, chunksize: int | None = None,
+                     loader: Loader | None = None) -> ImportStats:
+        """
+        imports many bank statement csvs, parsing them across a pool of processes
+
+        paths: a directory of csvs, a glob pattern, or a list of csv filenames
+
+        parsed rows are merged into batches of about chunksize rows, deduplicated, and inserted in order
+        (files in the given order, or sorted by name for a directory or glob, then rows in file order)
+
+        max_workers defaults to the number of cpus, chunksize to cfg.settings.import_chunksize, and loader
+        to cfg.settings.import_loader
+        """
+        if chunksize is None:
+            chunksize = cfg.settings.import_chunksize
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if isinstance(paths, str):
+            pattern = os.path.join(paths, "*.csv") if os.path.isdir(paths) else paths
+            paths = sorted(glob.glob(pattern))
+
+        start = time.perf_counter()
+        rows = 0
+        inserted = 0
+        with collect_stages() as stages:
+            parses = self._load_parses()
+            batch: list[pd.DataFrame] = []
+            batch_rows = 0
+
+            def insert_batch():
+                nonlocal batch, batch_rows, inserted
+                df = pd.concat(batch, ignore_index=True).drop_duplicates(
+                    subset=["date", "amount", "balance", "description_original"], ignore_index=True)
+                with self.engine.begin() as conn:
+                    self._save_parses(conn, df, parses)
+                    result = self._insert_records(conn, df, loader)
+                if result.data_version is not None:
+                    self._extend_snapshots(result.dates, result.data_version)
+                inserted += result.rows
+                batch, batch_rows = [], 0
+
+            with ProcessPoolExecutor(max_workers) as executor:
+                # only keep a couple of chunks per worker in flight, so that memory does not grow with the number of files
+                pending: deque[Future[pd.DataFrame]] = deque()
+                chunks = timed_iter("import.read_records", (chunk for path in paths
+                                                            for chunk in Database.read_records(path, chunksize=chunksize)))
+                for chunk in itertools.chain(chunks, [None]):
+                    if chunk is not None:
+                        rows += len(chunk)
+                        chunk = self._drop_imported(chunk)
+                    if chunk is not None and len(chunk) > 0:
+                        # only the parses the chunk needs, rather than pickling every parse for every chunk - this
+                        # is also a copy, as the chunk is pickled in the background while insert_batch adds new parses
+                        pending.append(executor.submit(
+                            Database.process_records, chunk, Database._parses_of(chunk, parses)))
+                    while pending and (chunk is None or len(pending) > 2 * max_workers):
+                        # process_records runs in the workers, where it is not timed, so time the wait for it instead
+                        with span("import.wait_for_workers"):
+                            df = pending.popleft().result()
+                        batch.append(df)
+                        batch_rows += len(df)
+                        if batch_rows >= chunksize:
+                            insert_batch()
+            if batch:
+                insert_batch()
+
+        return Database._import_stats(rows, inserted, time.perf_counter() - start, stages)
 
-    def add_records(self, csv_file: str):
-        # first we need to process the descriptions, and insert them into the description table
-        df = Database.process_records(csv_file)
-        descriptions = df["description"].apply(Database.process_description)
-        descriptions = pd.DataFrame.from_records(
-            descriptions, columns=["id", "processed"])
+    @staticmethod
+    def _parses_of(records: pd.DataFrame, parses: dict[str, DescriptionParse]) -> dict[str, DescriptionParse]:
+        """
+        returns the parses of the descriptions in records, rows of a bank statement csv as returned by read_records
+        """
+        result = {}
+        for desc in pd.unique(records["description_original"]):
+            raw = DESCRIPTION_PARTS.match(desc).group("description_raw")
+            if raw in parses:
+                result[raw] = parses[raw]
+        return result
+
+    @timed("import.load_parses")
+    def _load_parses(self) -> dict[str, DescriptionParse]:
+        """
+        returns the cached parse of every description imported so far by the current rules
+        """
+        parse = self.table_description_parse
+        with self.engine.connect() as conn:
+            rows = conn.execute(sql.select(parse.c["raw"], *[parse.c[field] for field in DescriptionParse._fields])
+                                .where(parse.c["rules_version"] == PARSE_RULES_VERSION)).all()
+        return {row[0]: DescriptionParse(*row[1:]) for row in rows}
+
+    @timed("import.save_parses")
+    def _save_parses(self, conn: sql.Connection, df: pd.DataFrame, parses: dict[str, DescriptionParse]):
+        """
+        caches the parses of the descriptions in df, a result of process_records, that are not in parses yet,
+        and adds them to parses
+        """
+        new = df.drop_duplicates("description_raw")
+        new = new[~new["description_raw"].isin(list(parses))]
+        if len(new) == 0:
+            return
+        records = new[["description_raw", *DescriptionParse._fields]].rename(columns={"description_raw": "raw"})
+        records["rules_version"] = PARSE_RULES_VERSION
+        conn.execute(psql.insert(self.table_description_parse).on_conflict_do_nothing(),
+                     records.to_dict(orient="records"))
+        for row in records.itertuples(index=False):
+            parses[row.raw] = DescriptionParse(row.description, row.location, row.description_id, row.processed)
+
+    @timed("import.drop_imported", rows=len)
+    def _drop_imported(self, records: pd.DataFrame) -> pd.DataFrame:
+        """
+        drops the rows of read_records that are already in the database, so that process_records does not spend
+        time parsing rows that would only be skipped on insert
+
+        the keys of records (the columns of the transaction table's unique constraint) are copied into a staging
+        table and joined against the transaction table on the same connection, so the work grows with records rather
+        than with the transactions already in its range of dates
+        """
+        if len(records) == 0:
+            return records
+        transaction = self.table_transaction
+        staging = self.table_record_staging
+        # amounts are stored to the cent, so compare them in cents rather than as floats or decimals - which are
+        # also much quicker to write out for COPY
+        keys = pd.DataFrame({"position": np.arange(len(records)),
+                             "date": np.datetime_as_string(records["date"].to_numpy(), unit="D"),
+                             "amount": np.rint(records["amount"].to_numpy() * 100).astype(np.int64),
+                             "balance": np.rint(records["balance"].to_numpy() * 100).astype(np.int64),
+                             "description_original": records["description_original"].to_numpy()})
+        with self.engine.begin() as conn:
+            staging.create(conn)
+            self._copy(conn, staging, keys)
+            # as one array rather than a row each, which would cost more than the comparison when all were imported
+            imported = conn.execute(
+                sql.select(func.array_agg(staging.c["position"]))
+                .join(transaction, sql.and_(
+                    transaction.c["date"] == staging.c["date"],
+                    sql.cast(transaction.c["amount"] * 100, sql.BigInteger) == staging.c["amount"],
+                    sql.cast(transaction.c["balance"] * 100, sql.BigInteger) == staging.c["balance"],
+                    transaction.c["description_original"] == staging.c["description_original"]))
+            ).scalar()
+        if not imported:
+            return records
+        return records[~np.isin(np.arange(len(records)), imported)]
+
+    @staticmethod
+    def _import_stats(rows: int, inserted: int, seconds: float, stages: dict[str, float]) -> ImportStats:
+        return {"rows": rows,
+                "inserted": inserted,
+                "duplicates": rows - inserted,
+                "seconds": seconds,
+                "rows_per_sec": rows / seconds if seconds > 0 else 0.0,
+                "stages": stages}
+
+    @timed("import.insert_records")
+    def _insert_records(self, conn: sql.Connection, df: pd.DataFrame, loader: Loader | None = None) -> _Inserted:
+        """
+        inserts rows returned by process_records, skipping any that are already in the database
+
+        only the days of the inserted rows have their rollup refreshed, and the data version is only increased
+        if something was inserted, so reimporting a statement leaves every cache valid
+        """
+        if len(df) == 0:
+            return _Inserted(0, [], None)
+        if loader is None:
+            loader = cfg.settings.import_loader
+
+        # process_records has already worked out the description of each row, for the description table
+        descriptions = (df[["description_id", "processed"]]
+                        .drop_duplicates("description_id", ignore_index=True)
+                        .rename(columns={"description_id": "id"}))
         descriptions["category_id"] = descriptions["id"].apply(
             lambda x: Constants.category_dict[x] if x in Constants.category_dict else None)
-        self.conn.execute(psql.insert(self.table_description).values(
-            descriptions.to_dict(orient="records")).on_conflict_do_nothing())
+        # then the transactions reference them by the foreign key
+        df = df[[column.name for column in self.table_transaction.columns if column.name in df.columns]]
+
+        match loader:
+            case "insert":
+                dates = self._insert_rows(conn, df, descriptions)
+            case "copy":
+                dates = self._copy_rows(conn, df, descriptions)
+        if not dates:
+            return _Inserted(0, [], None)
 
-        # then we can update the transaction table, with the foreign key constraint to the description
-        df["description_id"] = descriptions["id"]
-        self.conn.execute(psql.insert(self.table_transaction).values(
-            df.to_dict(orient="records")).on_conflict_do_nothing())
+        # finally the rollup needs refreshing for every day with new transactions
+        unique_dates = sorted(set(dates))
+        self.refresh_daily_category(conn, unique_dates)
 
-        # commmit changes
-        self.conn.commit()
+        data_version = self.table_data_version
+        version = conn.execute(sql.update(data_version).values(
+            version=data_version.c["version"] + 1).returning(data_version.c["version"])).scalar_one()
+        return _Inserted(len(dates), unique_dates, version)
 
-    def get_transactions_groupby(self):
+    def _insert_rows(self, conn: sql.Connection, df: pd.DataFrame, descriptions: pd.DataFrame) -> list[datetime.date]:
         """
-        returns the total amount spent on each day and each category
+        the "insert" loader
+
+        returns: the day of every inserted transaction
         """
-        description = self.table_description
         transaction = self.table_transaction
+        # executemany sends the rows in bounded batches, rather than as one giant VALUES list
+        conn.execute(psql.insert(self.table_description).on_conflict_do_nothing(),
+                     descriptions.to_dict(orient="records"))
+        # the driver needs None rather than NaN or NaT for nulls
+        inserted = conn.execute(
+            psql.insert(transaction).on_conflict_do_nothing().returning(
+                func.coalesce(transaction.c["value_date"], transaction.c["date"])),
+            df.astype(object).where(df.notna(), None).to_dict(orient="records"))
+        return list(inserted.scalars())
 
-        coalesce_date = func.coalesce(
-            transaction.c["value_date"], transaction.c["date"]).label("date")
-        query = (
-            sql.select(
-                coalesce_date,
-                description.c["category_id"],
-                func.sum(transaction.c["amount"]).label("amount")
-            )
-            .select_from(
-                transaction.join(
-                    description, transaction.c["description_id"] == description.c["id"], isouter=True)
-            )
-            .group_by(coalesce_date, description.c["category_id"])
-            .order_by(coalesce_date.asc())
-        )
+    def _copy_rows(self, conn: sql.Connection, df: pd.DataFrame, descriptions: pd.DataFrame) -> list[datetime.date]:
+        """
+        the "copy" loader - streams the rows into the staging tables with COPY, then merges each staging table
+        in with a single INSERT ... SELECT, leaving the unique constraint to skip rows already in the database
+
+        returns: the day of every inserted transaction
+        """
+        transaction = self.table_transaction
+        description = self.table_description
+        transaction_staging = self.table_transaction_staging
+        description_staging = self.table_description_staging
+        transaction_staging.create(conn)
+        description_staging.create(conn)
+
+        df = df.assign(position=np.arange(len(df)))
+        self._copy(conn, transaction_staging, df)
+        self._copy(conn, description_staging, descriptions.drop_duplicates("id"))
+
+        columns = [column.name for column in description.columns]
+        conn.execute(psql.insert(description)
+                     .from_select(columns, sql.select(*[description_staging.c[c] for c in columns]))
+                     .on_conflict_do_nothing())
+
+        # the rows keep their order in the file, as with the insert loader
+        columns = [column.name for column in transaction.columns if column.name != "id"]
+        inserted = conn.execute(
+            psql.insert(transaction)
+            .from_select(columns, sql.select(*[transaction_staging.c[c] for c in columns])
+                         .order_by(transaction_staging.c["position"]))
+            .on_conflict_do_nothing()
+            .returning(func.coalesce(transaction.c["value_date"], transaction.c["date"])))
+        return list(inserted.scalars())
+
+    @staticmethod
+    def _copy(conn: sql.Connection, table: sql.Table, df: pd.DataFrame):
+        """
+        streams the columns of df that table has into it with COPY, on conn's transaction
+        """
+        columns = [column.name for column in table.columns]
+        buffer = io.StringIO()
+        # \N marks a null, so that empty strings stay empty strings
+        df[columns].to_csv(buffer, index=False, header=False, na_rep="\\N", date_format="%Y-%m-%d")
+        buffer.seek(0)
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table.name} ({quoted}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+    @timed("import.extend_snapshots")
+    def _extend_snapshots(self, dates: list[datetime.date], data_version: int):
+        """
+        updates each snapshot for the days an import has just committed, rather than rebuilding it - the rows of
+        those days are fetched once for all of them
 
-        return self.conn.execute(query)
+        a snapshot that is missing or was not at the previous data version is deleted, so that no reader takes it
+        as current, and left to be rebuilt by get_prefix_sums or get_daily_matrix
+        """
+        snapshots = []
+        for kind in SNAPSHOTS:
+            snapshot = self.snapshots.get(kind, data_version - 1)
+            if snapshot is None:
+                self.snapshots.remove(kind)
+            else:
+                snapshots.append(snapshot)
+        if not snapshots:
+            return
+
+        daily = self.table_daily_category
+        rows = self._fetch(self.select_transactions_groupby().where(daily.c["date"].in_(dates)))
+        for snapshot in snapshots:
+            snapshot.update(rows, data_version)
+            self.snapshots.save(snapshot)
+
+    def _forget_snapshots(self):
+        """
+        deletes the saved snapshots, for when the data has changed without the data version increasing
+        """
+        for kind in SNAPSHOTS:
+            self.snapshots.remove(kind)
+
+    def _fetch(self, query: sql.Select) -> list[sql.RowMapping]:
+        """
+        runs the query on a connection from the pool, returning every row before the connection is returned
+        """
+        with self.engine.connect() as conn:
+            return list(conn.execute(query).mappings())
 
+    @timed("db.get_transactions_groupby", rows=len)
+    def get_transactions_groupby(self,
+                                 start_date: datetime.date | None = None,
+                                 end_date: datetime.date | None = None) -> list[sql.RowMapping]:
+        """
+        returns the total amount spent on each day and each category
+        """
+        return self._fetch(self.select_transactions_groupby(start_date, end_date))
+
+    @timed("db.get_transactions_for_category", rows=len)
     def get_transactions_for_category(self,
                                       category: str | None = None,
                                       start_date: datetime.date | None = None,
-                                      end_date: datetime.date | None = None):
+                                      end_date: datetime.date | None = None) -> list[sql.RowMapping]:
         """
         returns the total amount spent on each day in a particular category (or if category is not given, in total)
         """
-        description = self.table_description
-        transaction = self.table_transaction
+        return self._fetch(self.select_transactions_for_category(category, start_date, end_date))
 
-        coalesce_date = func.coalesce(
-            transaction.c["value_date"], transaction.c["date"]).label("date")
-        query = (
-            sql.select(
-                coalesce_date,
-                func.sum(transaction.c["amount"]).label("amount")
-            )
-            .select_from(
-                transaction.join(
-                    description, transaction.c["description_id"] == description.c["id"], isouter=True)
-            )
-        )
-        if category is not None:
-            query = query.where(description.c["category_id"] == category)
-        if start_date is not None:
-            query = query.where(coalesce_date >= start_date)
-        if end_date is not None:
-            query = query.where(coalesce_date <= end_date)
+    @timed("db.get_transactions_series", rows=len)
+    def get_transactions_series(self,
+                                category: str | None = None,
+                                start_date: datetime.date | None = None,
+                                end_date: datetime.date | None = None,
+                                avg_days: int | None = None) -> list[sql.RowMapping]:
+        """
+        get_transactions_for_category, but with a row for every day, and the moving average over avg_days either
+        side of each day if avg_days is given - both computed by the database
+        """
+        return self._fetch(self.select_transactions_series(category, start_date, end_date, avg_days))
+
+    @timed("db.get_transactions_buckets", rows=len)
+    def get_transactions_buckets(self,
+                                 category: str | None = None,
+                                 start_date: datetime.date | None = None,
+                                 end_date: datetime.date | None = None,
+                                 resolution: str = "month") -> list[sql.RowMapping]:
+        """
+        returns the total amount in each week, month or year (resolution) with any transactions in the category,
+        along with the first and last day in it that has transactions
+        """
+        return self._fetch(self.select_transactions_buckets(category, start_date, end_date, resolution))
+
+    @timed("db.get_date_bounds")
+    def get_date_bounds(self, category: str | None = None) -> tuple[datetime.date, datetime.date] | None:
+        """
+        returns the first and last day with transactions in the category (or in any category), or None if there are none
+        """
+        row = self._fetch(self.select_date_bounds(category))[0]
+        return (row["first"], row["last"]) if row["first"] is not None else None
 
-        query = (query
-                 .group_by(coalesce_date)
-                 .order_by(coalesce_date.asc()))
+    @timed("db.get_prefix_sums")
+    def get_prefix_sums(self, data_version: int | None = None) -> PrefixSums:
+        return self._get_snapshot(PrefixSums, data_version)
 
-        return self.conn.execute(query)
+    @timed("db.get_daily_matrix")
+    def get_daily_matrix(self, data_version: int | None = None) -> DailyMatrix:
+        return self._get_snapshot(DailyMatrix, data_version)
 
-    def get_categories(self):
-        category = self.table_category
-        query = sql.select(category.c["id"]).select_from(category)
-        return self.conn.execute(query)
+    def _get_snapshot(self, kind: type[S], data_version: int | None) -> S:
+        """
+        returns the snapshot of kind at data_version (by default the current version), as saved by add_records,
+        or rebuilt from the rollup if that is out of date
+        """
+        if data_version is None:
+            data_version = self.get_data_version()
+        snapshot = self.snapshots.get(kind, data_version)
+        if snapshot is None:
+            snapshot = kind.from_rows(self.get_transactions_groupby(), data_version)
+            self.snapshots.save(snapshot)
+        return snapshot
+
+    @timed("db.get_categories", rows=len)
+    def get_categories(self) -> list[sql.RowMapping]:
+        return self._fetch(self.select_categories())
+
+    @timed("db.get_data_version")
+    def get_data_version(self) -> int:
+        """
+        returns a number that increases whenever add_records changes the data
+        """
+        rows = self._fetch(self.select_data_version())
+        return rows[0]["version"] if rows else 0
+
+
+class AsyncDatabase(Schema):
+    """
+    the read queries of Database, run on an asyncpg connection pool so that the server
+    can keep many requests in flight without tying up a thread for each
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.DATABASE_URL = sql.make_url(url).set(
+            drivername="postgresql+asyncpg")
+        self.engine = create_async_engine(self.DATABASE_URL,
+                                          pool_size=cfg.settings.pg_pool_size,
+                                          max_overflow=cfg.settings.pg_max_overflow,
+                                          pool_timeout=cfg.settings.pg_pool_timeout,
+                                          pool_pre_ping=True)
+        self.snapshots = SnapshotCache(cfg.settings.cache_dir, url)
+        self._data_version: tuple[int, float] | None = None
+        """the data version last read by _recent_data_version, and when"""
+
+    async def _fetch(self, query: sql.Select) -> list[sql.RowMapping]:
+        async with self.engine.connect() as conn:
+            return list((await conn.execute(query)).mappings())
+
+    @timed("db.get_transactions_groupby", rows=len)
+    async def get_transactions_groupby(self,
+                                       start_date: datetime.date | None = None,
+                                       end_date: datetime.date | None = None) -> list[sql.RowMapping]:
+        """
+        returns the total amount spent on each day and each category
+        """
+        return await self._fetch(self.select_transactions_groupby(start_date, end_date))
+
+    @timed("db.get_transactions_for_category", rows=len)
+    async def get_transactions_for_category(self,
+                                            category: str | None = None,
+                                            start_date: datetime.date | None = None,
+                                            end_date: datetime.date | None = None) -> list[sql.RowMapping]:
+        """
+        returns the total amount spent on each day in a particular category (or if category is not given, in total)
+        """
+        return await self._fetch(self.select_transactions_for_category(category, start_date, end_date))
+
+    @timed("db.get_transactions_series", rows=len)
+    async def get_transactions_series(self,
+                                      category: str | None = None,
+                                      start_date: datetime.date | None = None,
+                                      end_date: datetime.date | None = None,
+                                      avg_days: int | None = None) -> list[sql.RowMapping]:
+        """
+        get_transactions_for_category, but with a row for every day, and the moving average over avg_days either
+        side of each day if avg_days is given - both computed by the database
+        """
+        return await self._fetch(self.select_transactions_series(category, start_date, end_date, avg_days))
+
+    @timed("db.get_transactions_buckets", rows=len)
+    async def get_transactions_buckets(self,
+                                       category: str | None = None,
+                                       start_date: datetime.date | None = None,
+                                       end_date: datetime.date | None = None,
+                                       resolution: str = "month") -> list[sql.RowMapping]:
+        """
+        returns the total amount in each week, month or year (resolution) with any transactions in the category,
+        along with the first and last day in it that has transactions
+        """
+        return await self._fetch(self.select_transactions_buckets(category, start_date, end_date, resolution))
+
+    @timed("db.get_date_bounds")
+    async def get_date_bounds(self, category: str | None = None) -> tuple[datetime.date, datetime.date] | None:
+        """
+        returns the first and last day with transactions in the category (or in any category), or None if there are none
+        """
+        row = (await self._fetch(self.select_date_bounds(category)))[0]
+        return (row["first"], row["last"]) if row["first"] is not None else None
+
+    @timed("db.get_prefix_sums")
+    async def get_prefix_sums(self, data_version: int | None = None) -> PrefixSums:
+        return await self._get_snapshot(PrefixSums, data_version)
+
+    @timed("db.get_daily_matrix")
+    async def get_daily_matrix(self, data_version: int | None = None) -> DailyMatrix:
+        return await self._get_snapshot(DailyMatrix, data_version)
+
+    async def _get_snapshot(self, kind: type[S], data_version: int | None) -> S:
+        """
+        returns the snapshot of kind at data_version (by default the current version), as saved by add_records,
+        or rebuilt from the rollup if that is out of date
+
+        loading, rebuilding and saving the snapshot run in a thread, so that they do not hold up the event loop
+        """
+        if data_version is None:
+            data_version = await self.get_data_version()
+        snapshot = await asyncio.to_thread(self.snapshots.get, kind, data_version)
+        if snapshot is None:
+            rows = await self.get_transactions_groupby()
+            snapshot = await asyncio.to_thread(self._rebuild_snapshot, kind, rows, data_version)
+        return snapshot
+
+    def _rebuild_snapshot(self, kind: type[S], rows: list[sql.RowMapping], data_version: int) -> S:
+        snapshot = kind.from_rows(rows, data_version)
+        self.snapshots.save(snapshot)
+        return snapshot
+
+    @timed("db.get_daily_matrix_version")
+    async def get_daily_matrix_version(self) -> int:
+        """
+        returns the current data version, for reading the daily matrix at - that of the saved matrix if add_records
+        has kept it current, else the database's, at which get_daily_matrix rebuilds it
+
+        the database is asked at most once every cfg.settings.data_version_ttl seconds, while a saved matrix newer
+        than the version last read shows the version has increased since
+        """
+        daily_matrix = await asyncio.to_thread(self.snapshots.saved, DailyMatrix)
+        data_version = await self._recent_data_version()
+        if daily_matrix is None:
+            return data_version
+        return max(daily_matrix.data_version, data_version)
+
+    async def _recent_data_version(self) -> int:
+        """
+        get_data_version, reused for cfg.settings.data_version_ttl seconds
+        """
+        now = time.monotonic()
+        if self._data_version is None or now - self._data_version[1] >= cfg.settings.data_version_ttl:
+            self._data_version = (await self.get_data_version(), now)
+        return self._data_version[0]
+
+    @timed("db.get_categories", rows=len)
+    async def get_categories(self) -> list[sql.RowMapping]:
+        return await self._fetch(self.select_categories())
+
+    @timed("db.get_data_version")
+    async def get_data_version(self) -> int:
+        """
+        returns a number that increases whenever add_records changes the data
+        """
+        rows = await self._fetch(self.select_data_version())
+        return rows[0]["version"] if rows else 0
 
 
 if __name__ == "__main__":
@@ -257,18 +1088,21 @@ if __name__ == "__main__":
         db.drop_all()
         db.initialise_empty_tables()
 
-        db.add_records("data/2022to2024transactions-Copy1.csv")
-        db.add_records("data/2024-dec.csv")
+        stats = db.import_files(
+            ["data/2022to2024transactions-Copy1.csv", "data/2024-dec.csv"])
+        print(
+            f"{stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        for stage, seconds in stats["stages"].items():
+            print(f"  {stage}: {seconds:.2f}s")
 
         print("Records inserted into database")
 
     result = db.get_transactions_groupby()
-    print(result.keys())
-    print(result.fetchmany(5))
+    print(result[:5])
 
     result = db.get_transactions_for_category("fuel")
-    print(result.keys())
-    print(result.fetchmany(5))
+    print(result[:5])
 
 
 DB = Database(cfg.settings.pg_connection_uri)
+ADB = AsyncDatabase(cfg.settings.pg_connection_uri)
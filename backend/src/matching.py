@@ -0,0 +1,153 @@
+import re
+from typing import Any, Iterable, Iterator
+
+_END = ""
+"""key marking the end of a word in a trie node - never clashes with a single character key"""
+
+
+class Trie:
+    """
+    a character trie over a set of words
+
+    used in place of regexes that alternate over thousands of literal strings
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        self.root: dict[str, Any] = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str, value: Any = True):
+        if word == "":
+            return
+        node = self.root
+        for c in word:
+            node = node.setdefault(c, {})
+        node[_END] = value
+
+    def prefixes(self, text: str, start: int = 0) -> Iterator[tuple[int, Any]]:
+        """
+        yields the end index in text and the stored value of every word that text[start:] starts with, shortest first
+        """
+        node = self.root
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                return
+            if _END in node:
+                yield i + 1, node[_END]
+
+    def longest_prefix(self, text: str, start: int = 0) -> tuple[int, Any] | None:
+        """
+        finds the longest word that text[start:] starts with
+
+        returns: a tuple of the end index of the word in text, and the value stored with the word
+
+        if no word matches returns None
+        """
+        node = self.root
+        result = None
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if _END in node:
+                result = i + 1, node[_END]
+        return result
+
+    def search(self, text: str) -> tuple[int, int] | None:
+        """
+        finds the leftmost word in text, preferring the longest word if several start at the same index
+
+        this is the same match that re.search gives for an alternation of the words sorted longest first
+
+        returns: the span of the match, or None if there is no match
+        """
+        for start in range(len(text)):
+            match = self.longest_prefix(text, start)
+            if match is not None:
+                return start, match[0]
+        return None
+
+
+class SuburbMatcher:
+    """
+    finds suburb names, and suburb names that have been truncated, in lowercased descriptions
+    """
+
+    def __init__(self, suburbs: Iterable[str], truncated_suburbs: Iterable[str]):
+        self.suburbs = Trie(s.lower() for s in suburbs)
+        # stored reversed so that the longest truncated suburb ending a string is a prefix search
+        self.truncated_suburbs = Trie(s.lower()[::-1] for s in truncated_suburbs)
+
+    def search(self, text: str) -> tuple[int, int] | None:
+        """
+        returns: the span of the leftmost (and then longest) suburb in text, or None if there is no suburb
+        """
+        return self.suburbs.search(text)
+
+    def search_truncated_suffix(self, text: str) -> int | None:
+        """
+        returns: the start index of the longest truncated suburb that text ends with, or None if there is no such suburb
+        """
+        match = self.truncated_suburbs.longest_prefix(text[::-1])
+        if match is None:
+            return None
+        return len(text) - match[0]
+
+
+class DescriptionMatcher:
+    """
+    maps a description to its display name using the rules in _DescRules, compiled once
+
+    the rules are checked in order of precedence: exact names, then the starts_with_set prefixes,
+    then the starts_with_dict prefixes, then the regexes
+    """
+
+    def __init__(self,
+                 display_name_dict: dict[str, str],
+                 starts_with_set: Iterable[str],
+                 starts_with_dict: dict[str, str],
+                 regex_dict: dict[str, str]):
+        self.display_name_dict = dict(display_name_dict)
+
+        # every prefix is stored with a rank, and the lowest ranked match wins:
+        # starts_with_set before starts_with_dict, then longer prefixes first for starts_with_set (which is unordered)
+        # and dictionary order for starts_with_dict
+        ranked = [((0, -len(s)), s.lower(), s) for s in starts_with_set]
+        ranked += [((1, i), k.lower(), v)
+                   for i, (k, v) in enumerate(starts_with_dict.items())]
+        self.prefixes = Trie()
+        # added worst first, so that if two rules share a prefix the better one overwrites the other
+        for rank, prefix, name in sorted(ranked, reverse=True):
+            self.prefixes.add(prefix, (rank, name))
+
+        # all the regexes are combined into one alternation, so a description that matches none of them
+        # (the common case) is rejected in a single pass - the groups are non-capturing because capturing
+        # groups stop re from optimising the alternation
+        self.regex_names = list(regex_dict.values())
+        self.regexes = [re.compile(k, flags=re.IGNORECASE) for k in regex_dict]
+        self.regex = None
+        if regex_dict:
+            self.regex = re.compile("|".join(f"(?:{k})" for k in regex_dict),
+                                    flags=re.IGNORECASE)
+
+    def match(self, desc: str) -> str | None:
+        """
+        returns: the display name given by the highest precedence rule that matches desc, or None if no rule matches
+        """
+        if desc in self.display_name_dict:
+            return self.display_name_dict[desc]
+
+        best = min((value for _, value in self.prefixes.prefixes(desc.lower())), default=None)
+        if best is not None:
+            return best[1]
+
+        if self.regex is not None:
+            if self.regex.search(desc):
+                # some rule matches, so find the first one in dictionary order
+                for regex, name in zip(self.regexes, self.regex_names):
+                    if regex.search(desc):
+                        return name
+
+        return None
@@ -1,7 +1,28 @@
-from typing import Sequence
+import functools
+from typing import Literal, Sequence
 
 import numpy as np
 
+Kernel = Literal["box", "bump", "gaussian", "triangular", "exponential"]
+
+FFT_MIN_WIDTH = 512
+"""the kernel width from which correlate_window uses the FFT on a 1-D series - np.correlate is fast up to about here"""
+FFT_MIN_WIDTH_2D = 48
+"""the same for a 2-D series, where the direct method takes one pass over every column per weight"""
+
+
+def bump(y: np.ndarray) -> np.ndarray:
+    """
+    the bump function exp(-1 / (1 - y^2)), which is 0 wherever |y| >= 1
+
+    only evaluated inside (-1, 1), as at the endpoints 1 - y^2 is 0 and numpy warns about dividing by it
+    """
+    y = np.asarray(y, dtype=np.float64)
+    result = np.zeros(y.shape, dtype=np.float64)
+    inside = np.abs(y) < 1
+    result[inside] = np.exp(-1 / (1 - y[inside] ** 2))
+    return result
+
 
 def convolve_smooth(x: Sequence[float]) -> float:
     """
@@ -10,9 +31,134 @@ def convolve_smooth(x: Sequence[float]) -> float:
         x: assumed to be equidistant points in [-1, 1]
     """
 
-    def bump(y): return np.exp(-1/(1-y**2))
     n = len(x)
     # scaling should be done in a way so that if the inputs are all 1s, then the output should be 1
     scaling = np.sum(np.ones(n) * bump(np.linspace(1, -1, n, endpoint=True)))
 
     return np.sum(x * bump(np.linspace(1, -1, n, endpoint=True))) / scaling
+
+
+@functools.lru_cache
+def box_kernel(width: int) -> np.ndarray:
+    """
+    a kernel of the given width where every weight is 1 / width
+
+    the returned array is cached, so it is read-only
+    """
+    kernel = np.full(width, 1 / width, dtype=np.float64)
+    kernel.flags.writeable = False
+    return kernel
+
+
+@functools.lru_cache
+def bump_kernel(width: int) -> np.ndarray:
+    """
+    the weights that convolve_smooth applies to a window of the given width, normalised to sum to 1
+
+    a window of at most 2 only has the endpoints, where the bump is 0, so its weights are equal instead
+
+    the returned array is cached, so it is read-only
+    """
+    weights = bump(np.linspace(1, -1, width, endpoint=True))
+    if not weights.any():
+        weights = np.ones(width)
+    kernel = weights / np.sum(weights)
+    kernel.flags.writeable = False
+    return kernel
+
+
+@functools.lru_cache
+def kernel_weights(name: Kernel, radius: int) -> np.ndarray:
+    """
+    the weights of the named kernel over the radius days either side of a day and the day itself, normalised to
+    sum to 1:
+    - box: equal weights, as box_kernel
+    - bump: the bump function of convolve_smooth, as bump_kernel
+    - gaussian: the normal curve with a standard deviation of radius / 3
+    - triangular: falling linearly from the middle to 0 just beyond the window
+    - exponential: falling by a factor of e every radius / 3 days from the middle
+
+    the returned array is cached, so it is read-only
+    """
+    width = 2 * radius + 1
+    offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+    scale = max(radius, 1) / 3
+    match name:
+        case "box":
+            return box_kernel(width)
+        case "bump":
+            return bump_kernel(width)
+        case "gaussian":
+            weights = np.exp(-0.5 * (offsets / scale) ** 2)
+        case "triangular":
+            weights = radius + 1 - np.abs(offsets)
+        case "exponential":
+            weights = np.exp(-np.abs(offsets) / scale)
+    result = weights / np.sum(weights)
+    result.flags.writeable = False
+    return result
+
+
+def correlate_window(x: np.ndarray, kernel: np.ndarray, radius: int) -> np.ndarray:
+    """
+    slides the kernel over x, where the window for output i starts at x[i - radius] - the kernel can be at most
+    2 * radius + 1 wide
+
+    x is treated as zero outside of its bounds, and the output has the same shape as x
+
+    if x is 2-D every column is processed at once, with the window sliding down the rows
+    """
+    n = len(x)
+    if n == 0:
+        return np.zeros(x.shape, dtype=np.float64)
+    padded = np.pad(x, [(radius, radius)] + [(0, 0)] * (x.ndim - 1))
+    if len(kernel) >= (FFT_MIN_WIDTH if x.ndim == 1 else FFT_MIN_WIDTH_2D):
+        return _correlate_fft(padded, kernel, n)
+    if x.ndim == 1:
+        return np.correlate(padded, kernel, mode="valid")[:n]
+
+    # one pass per kernel weight, each over every column
+    result = np.zeros(x.shape, dtype=np.float64)
+    for i, weight in enumerate(kernel):
+        result += weight * padded[i:i + n]
+    return result
+
+
+def _correlate_fft(padded: np.ndarray, kernel: np.ndarray, n: int) -> np.ndarray:
+    """
+    the first n outputs of sliding the kernel down padded, as a product of FFTs - O(n log n) however wide the kernel,
+    but not exact, so days that would be 0 come out as tiny amounts instead
+    """
+    width = len(kernel)
+    length = 1 << int(np.ceil(np.log2(len(padded) + width - 1)))
+    # correlating with the kernel is convolving with it reversed
+    spectrum = np.fft.rfft(kernel[::-1], length).reshape(-1, *[1] * (padded.ndim - 1))
+    convolved = np.fft.irfft(np.fft.rfft(padded, length, axis=0) * spectrum, length, axis=0)
+    return convolved[width - 1:width - 1 + n]
+
+
+def exponential_moving_average(x: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], with x treated as zero before its start - a recursive filter, so
+    O(n) however slowly it decays
+
+    if x is 2-D every column is filtered at once
+    """
+    n = len(x)
+    decay = 1 - alpha
+    if n == 0 or decay <= 0:
+        return alpha * np.asarray(x, dtype=np.float64)
+
+    # y[i] = alpha * decay^i * sum(x[j] / decay^j for j <= i), which numpy can do with a cumsum - in blocks short
+    # enough for decay^-j to stay finite, each carrying on from the last output of the one before
+    block = max(1, int(200 / -np.log10(decay)))
+    shape = (-1, *[1] * (x.ndim - 1))
+    result = np.empty(x.shape, dtype=np.float64)
+    carry = np.zeros(x.shape[1:], dtype=np.float64)
+    for start in range(0, n, block):
+        chunk = x[start:start + block]
+        powers = (decay ** np.arange(len(chunk), dtype=np.float64)).reshape(shape)
+        output = alpha * np.cumsum(chunk / powers, axis=0) * powers + decay * powers * carry
+        result[start:start + len(chunk)] = output
+        carry = output[-1]
+    return result
@@ -0,0 +1,190 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Iterator
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""upper bounds in seconds of the latency histogram buckets, from well under a millisecond for cached work up to a large import chunk"""
+
+
+class Histogram:
+    """
+    a count of the observations falling in each bucket, along with their sum, for each combination of label values
+
+    buckets are cumulative as in Prometheus, so the count of a bucket includes every observation at most its bound
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        """for each label values, the count in each bucket (the last being +Inf), and the sum as a one item list"""
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, list(counts), total[0]) for key, (counts, total) in self._values.items())
+        for label_values, counts, total in values:
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                le = _labels((*self.labels, "le"), (*label_values, str(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter:
+    """
+    a total that only increases, for each combination of label values
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, label_values)} {value}" for label_values, value in values]
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+STAGE_SECONDS = Histogram("finance_stage_seconds", "time spent in each stage of serving a request or importing",
+                          ("stage",))
+STAGE_ROWS = Counter("finance_stage_rows_total", "rows (or days) processed by each stage", ("stage",))
+REQUEST_SECONDS = Histogram("finance_request_seconds", "time to respond to each request",
+                            ("method", "path", "status"))
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, STAGE_ROWS]
+
+
+def render() -> str:
+    """
+    every metric in the Prometheus text exposition format
+    """
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+_stages: ContextVar[dict[str, float] | None] = ContextVar("stages", default=None)
+"""the seconds spent in each stage so far by the enclosing collect_stages, if there is one"""
+
+
+@contextmanager
+def collect_stages() -> Iterator[dict[str, float]]:
+    """
+    yields a dict which, once the block exits, holds the total seconds spent in each stage timed within it -
+    including in tasks started within it, which inherit the context
+    """
+    stages: dict[str, float] = {}
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+def record(stage: str, seconds: float, rows: int | None = None):
+    STAGE_SECONDS.observe(seconds, stage)
+    if rows is not None:
+        STAGE_ROWS.inc(rows, stage)
+    stages = _stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    times the block as stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage: str, rows: Callable[[Any], int] | None = None):
+    """
+    decorates a function, or a coroutine function, to time each call as stage
+
+    rows: given the result, returns how many rows it processed, to count in finance_stage_rows_total
+    """
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = await f(*args, **kwargs)
+                record(stage, time.perf_counter() - start, rows(result) if rows is not None else None)
+                return result
+        else:
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = f(*args, **kwargs)
+                record(stage, time.perf_counter() - start, rows(result) if rows is not None else None)
+                return result
+        return wrapper
+    return decorator
+
+
+def timed_iter(stage: str, iterable: Iterable) -> Iterator:
+    """
+    yields the items of iterable, timing how long each takes to produce as stage - e.g. reading a csv in chunks
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record(stage, time.perf_counter() - start, len(item) if hasattr(item, "__len__") else None)
+        yield item
+
+
+def server_timing(stages: dict[str, float]) -> str:
+    """
+    stages as a Server-Timing header, which browser devtools show alongside the request
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in stages.items())
@@ -0,0 +1,74 @@
+import datetime
+
+import numpy as np
+
+from .snapshot import DailySnapshot
+
+
+class PrefixSums(DailySnapshot):
+    """
+    a running total of the daily amounts of every category, so that the total over any range of days, and so
+    every moving average of average_amounts, is the difference of two of its rows
+
+    values[i, j] is the total, in cents, over the days before start + i of column j
+    """
+
+    kind = "prefix-sums"
+    dtype = np.int64
+    leading_rows = 1
+
+    def _set(self, offsets: np.ndarray, columns: np.ndarray, amounts: np.ndarray):
+        # only the rows from the earliest changed day onwards are touched, so adding recent days is cheap
+        cents = np.round(amounts * 100).astype(np.int64)
+        delta = cents - (self.values[offsets + 1, columns] - self.values[offsets, columns])
+        first = int(offsets.min())
+        deltas = np.zeros((len(self) - first, self.values.shape[1]), dtype=np.int64)
+        np.add.at(deltas, (offsets - first, columns), delta)
+        np.add.at(deltas, (offsets - first, 0), delta)
+        self.values[first + 1:] += np.cumsum(deltas, axis=0)
+
+    def _rows_after(self, n: int) -> np.ndarray:
+        return np.repeat(self.values[-1:], n, axis=0)
+
+    def _cumulative(self, column: int | None, days: np.ndarray) -> np.ndarray:
+        """
+        the total over every day before each of days, in cents
+        """
+        if column is None:
+            return np.zeros(len(days), dtype=np.int64)
+        return self.values[np.clip(days - self.start, 0, len(self)), column]
+
+    def total(self, category: str | None, start_date: datetime.date, end_date: datetime.date) -> float:
+        """
+        the total amount from start_date to end_date inclusive
+        """
+        if end_date < start_date:
+            return 0.0
+        days = np.array([start_date.toordinal(), end_date.toordinal() + 1])
+        before_start, before_end = self._cumulative(self._column(category), days)
+        return int(before_end - before_start) / 100
+
+    def totals(self, category: str | None, edges: np.ndarray) -> np.ndarray:
+        """
+        the total amount over each range of days from edges[i] up to but excluding edges[i + 1], where edges are ordinals
+        """
+        return np.diff(self._cumulative(self._column(category), edges)) / 100
+
+    def daily(self, category: str | None, start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+        """
+        the amount on every day from start_date to end_date inclusive
+        """
+        return self.averaged(category, start_date, end_date, 0)
+
+    def averaged(self, category: str | None, start_date: datetime.date, end_date: datetime.date,
+                 avg_days: int) -> np.ndarray:
+        """
+        average_amounts of the daily amounts from start_date to end_date inclusive, so days outside of that range
+        count as 0 even where there is data
+        """
+        column = self._column(category)
+        first, last = start_date.toordinal(), end_date.toordinal()
+        days = np.arange(first, last + 1, dtype=np.int64)
+        totals = (self._cumulative(column, np.clip(days + avg_days + 1, first, last + 1))
+                  - self._cumulative(column, np.clip(days - avg_days, first, last + 1)))
+        return totals / (100 * (2 * avg_days + 1))
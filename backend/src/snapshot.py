@@ -0,0 +1,322 @@
+import abc
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Iterable, Mapping, Self, TypeVar
+
+import numpy as np
+
+
+class DailySnapshot(abc.ABC):
+    """
+    an array with a row for each day (as PrefixSums and DailyMatrix keep it) and a column for each category, derived
+    from the rows of get_transactions_groupby at data_version
+
+    column 0 is of every category, and answers queries for category None as in get_transactions_for_category, while
+    column j is of categories[j - 1]
+
+    saved as a small .json header, with the array in an .npy file that is memory mapped when loaded - so every
+    server process shares one copy in the page cache, and a loaded snapshot is read-only until update copies it
+
+    days are stored as ordinals (datetime.date.toordinal)
+    """
+
+    kind: str
+    """names the files the snapshot is saved to, see snapshot_file"""
+    dtype: type
+    leading_rows = 0
+    """rows of values before the first day"""
+
+    def __init__(self, start: int, categories: list[str | None], values: np.ndarray, bounds: np.ndarray,
+                 data_version: int):
+        self.start = start
+        self.categories = categories
+        self.values = values
+        self.bounds = bounds
+        """bounds[j] is the first and last day with a row in column j"""
+        self.data_version = data_version
+        self.saved: tuple[int, int] | None = None
+        """the inode and modification time of the header this was last loaded from or saved to, see is_saved"""
+        self._columns = {category: j + 1 for j, category in enumerate(categories)}
+
+    @classmethod
+    def empty(cls, data_version: int = 0) -> Self:
+        return cls(0, [], np.zeros((cls.leading_rows, 1), dtype=cls.dtype), _no_bounds(1), data_version)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping], data_version: int) -> Self:
+        """
+        builds the snapshot from the rows of get_transactions_groupby
+        """
+        snapshot = cls.empty(data_version)
+        snapshot.update(rows, data_version)
+        return snapshot
+
+    def __len__(self) -> int:
+        """
+        the number of days covered
+        """
+        return len(self.values) - self.leading_rows
+
+    def update(self, rows: Iterable[Mapping], data_version: int):
+        """
+        sets the amount of each (date, category_id) in rows, in the form of get_transactions_groupby, leaving other days alone
+        """
+        rows = list(rows)
+        self.data_version = data_version
+        self.saved = None
+        if not rows:
+            return
+
+        days = np.fromiter((row["date"].toordinal() for row in rows), dtype=np.int64, count=len(rows))
+        amounts = np.fromiter((row["amount"] for row in rows), dtype=np.float64, count=len(rows))
+        for row in rows:
+            if row["category_id"] not in self._columns:
+                self._add_column(row["category_id"])
+        columns = np.fromiter((self._columns[row["category_id"]] for row in rows), dtype=np.int64, count=len(rows))
+
+        self._cover(int(days.min()), int(days.max()))
+        if not self.values.flags.writeable:
+            self.values = np.array(self.values)
+        self._set(days - self.start, columns, amounts)
+
+        for column in [0, *np.unique(columns)]:
+            in_column = days if column == 0 else days[columns == column]
+            self.bounds[column] = [min(self.bounds[column, 0], in_column.min()),
+                                   max(self.bounds[column, 1], in_column.max())]
+
+    @abc.abstractmethod
+    def _set(self, offsets: np.ndarray, columns: np.ndarray, amounts: np.ndarray):
+        """
+        sets the amount of each day, as an offset from start, in each column
+        """
+
+    def _add_column(self, category: str | None):
+        self.categories.append(category)
+        self._columns[category] = len(self.categories)
+        self.values = np.hstack([self.values, np.zeros((len(self.values), 1), dtype=self.dtype)])
+        self.bounds = np.vstack([self.bounds, _no_bounds(1)])
+
+    def _cover(self, first: int, last: int):
+        """
+        extends the days covered to include first to last, where the new days have an amount of 0
+        """
+        if len(self) == 0:
+            self.start = first
+        if first < self.start:
+            self.values = np.vstack([np.zeros((self.start - first, self.values.shape[1]), dtype=self.dtype),
+                                     self.values])
+            self.start = first
+        end = self.start + len(self)
+        if last >= end:
+            self.values = np.vstack([self.values, self._rows_after(last - end + 1)])
+
+    def _rows_after(self, n: int) -> np.ndarray:
+        """
+        the rows for n days after the last day covered, where each has an amount of 0
+        """
+        return np.zeros((n, self.values.shape[1]), dtype=self.dtype)
+
+    def date_bounds(self, category: str | None) -> tuple[datetime.date, datetime.date] | None:
+        """
+        returns: the first and last day with a row in the category (or if category is None, in any category), or
+        None if there are no rows
+        """
+        column = self._column(category)
+        if column is None:
+            return None
+        first, last = self.bounds[column]
+        if first > last:
+            return None
+        return datetime.date.fromordinal(int(first)), datetime.date.fromordinal(int(last))
+
+    def _column(self, category: str | None) -> int | None:
+        return 0 if category is None else self._columns.get(category)
+
+    def save(self, filename: str):
+        """
+        writes the snapshot to filename, the .json header, with the values in an .npy file named after it and the
+        data version - the header is replaced last, so a reader never sees a half written snapshot
+
+        the .npy files of older versions are then deleted, which does not disturb processes that have them mapped
+        """
+        base = os.path.splitext(filename)[0]
+        values_file = f"{base}-{self.data_version}.npy"
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        _replace(values_file, lambda f: np.save(f, np.ascontiguousarray(self.values)))
+        _replace(filename, lambda f: f.write(json.dumps({
+            "start": self.start,
+            "categories": self.categories,
+            "bounds": self.bounds.tolist(),
+            "data_version": self.data_version,
+            "values": os.path.basename(values_file),
+        }).encode()))
+        stat = os.stat(filename)
+        self.saved = (stat.st_ino, stat.st_mtime_ns)
+        for version, old in _values_files(filename):
+            if version < self.data_version:
+                _remove(old)
+
+    @classmethod
+    def load(cls, filename: str) -> Self | None:
+        """
+        returns: the snapshot saved in filename, with its values memory mapped, or None if there is none that can be read
+        """
+        try:
+            with open(filename, "rb") as f:
+                stat = os.fstat(f.fileno())
+                header = json.load(f)
+            values = np.load(os.path.join(os.path.dirname(filename), header["values"]), mmap_mode="r",
+                             allow_pickle=False)
+            snapshot = cls(header["start"], header["categories"], values,
+                           np.array(header["bounds"], dtype=np.int64).reshape(-1, 2), header["data_version"])
+        except (OSError, ValueError, KeyError):
+            return None
+        snapshot.saved = (stat.st_ino, stat.st_mtime_ns)
+        return snapshot
+
+    def is_saved(self, filename: str) -> bool:
+        """
+        whether this was last loaded from or saved to filename, and it has not been saved over since - which only
+        needs a stat, as save replaces the header rather than writing to it
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        return self.saved == (stat.st_ino, stat.st_mtime_ns)
+
+    @staticmethod
+    def saved_version(filename: str) -> int | None:
+        """
+        returns: the data version of the snapshot saved in filename, or None if there is none
+        """
+        try:
+            with open(filename, "rb") as f:
+                return int(json.load(f)["data_version"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def remove(filename: str):
+        """
+        deletes the snapshot saved in filename, if there is one
+        """
+        _remove(filename)
+        for _, values_file in _values_files(filename):
+            _remove(values_file)
+
+
+S = TypeVar("S", bound=DailySnapshot)
+
+
+class SnapshotCache:
+    """
+    the snapshots of the database at url, each kept in memory as last loaded or saved by this process, and saved
+    in cache_dir for the others
+    """
+
+    def __init__(self, cache_dir: str, url: str):
+        self.cache_dir = cache_dir
+        self.url = url
+        self._snapshots: dict[type[DailySnapshot], DailySnapshot] = {}
+
+    def file(self, kind: type[DailySnapshot]) -> str:
+        return snapshot_file(self.cache_dir, self.url, kind.kind)
+
+    def get(self, kind: type[S], data_version: int) -> S | None:
+        """
+        returns: the snapshot of kind at data_version, from memory or else as saved, or None if neither is at it
+        """
+        snapshot = self._snapshots.get(kind)
+        if snapshot is None or snapshot.data_version != data_version:
+            snapshot = kind.load(self.file(kind))
+            if snapshot is None or snapshot.data_version != data_version:
+                return None
+            self._snapshots[kind] = snapshot
+        return snapshot
+
+    def saved(self, kind: type[S]) -> S | None:
+        """
+        returns: the snapshot of kind as last saved by any process, or None if there is none - the one in memory is
+        reused until the saved one changes, so that this only needs a stat
+        """
+        snapshot = self._snapshots.get(kind)
+        if snapshot is None or not snapshot.is_saved(self.file(kind)):
+            snapshot = kind.load(self.file(kind))
+            if snapshot is None:
+                return None
+            self._snapshots[kind] = snapshot
+        return snapshot
+
+    def save(self, snapshot: DailySnapshot):
+        """
+        keeps the snapshot in memory, and saves it unless a newer version has been saved in the meantime
+        """
+        self._snapshots[type(snapshot)] = snapshot
+        filename = self.file(type(snapshot))
+        saved_version = DailySnapshot.saved_version(filename)
+        if saved_version is None or saved_version <= snapshot.data_version:
+            snapshot.save(filename)
+
+    def remove(self, kind: type[DailySnapshot]):
+        """
+        forgets the snapshot of kind, and deletes it if saved
+        """
+        self._snapshots.pop(kind, None)
+        DailySnapshot.remove(self.file(kind))
+
+
+def _replace(filename: str, write):
+    """
+    writes filename with write, given a binary file, replacing it atomically
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=os.path.splitext(filename)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _remove(filename: str):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def _values_files(filename: str) -> list[tuple[int, str]]:
+    """
+    the .npy files saved alongside the header filename, with the data version of each
+    """
+    base = os.path.splitext(filename)[0]
+    pattern = re.compile(re.escape(os.path.basename(base)) + r"-(\d+)\.npy")
+    result = []
+    for path in glob.glob(f"{glob.escape(base)}-*.npy"):
+        match = pattern.fullmatch(os.path.basename(path))
+        if match is not None:
+            result.append((int(match[1]), path))
+    return result
+
+
+def _no_bounds(n: int) -> np.ndarray:
+    """
+    bounds for n columns without any rows, which the first row of each replaces
+    """
+    return np.tile(np.array([np.iinfo(np.int64).max, np.iinfo(np.int64).min], dtype=np.int64), (n, 1))
+
+
+def snapshot_file(cache_dir: str, url: str, kind: str) -> str:
+    """
+    where the snapshot of the given kind of the database at url is saved - each database gets its own file, as data
+    versions are only comparable within one database
+    """
+    digest = hashlib.sha256(str(url).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{kind}-{digest}.json")
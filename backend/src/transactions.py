@@ -1,8 +1,13 @@
 import datetime
 
-from src.database import DB
+from src.database import ADB, DB
+from src.metrics import timed
+from src.daily_matrix import DailyMatrix
+from src.prefix_sums import PrefixSums
 import src.math as math
-from typing import TypedDict
+from typing import Iterable, Literal, Mapping, NamedTuple, TypedDict
+
+import numpy as np
 
 
 class Transaction(TypedDict):
@@ -10,67 +15,454 @@ class Transaction(TypedDict):
     amount: float
 
 
+Resolution = Literal["day", "week", "month", "year"]
+"""
+the period each amount of a series covers - weeks start on Monday, as with Postgres' date_trunc
+"""
+
+SmoothingKernel = Literal["bump", "gaussian", "triangular", "exponential", "ema"]
+"""
+the weights of the "smoothed" smoothing - one of the kernels of math.kernel_weights over avg_days either side of each
+day, or "ema", an exponential moving average over the days before each day that halves in weight about every
+0.7 * avg_days days
+"""
+
+STEP_DAYS: dict[Resolution, int | None] = {"day": 1, "week": 7, "month": None, "year": None}
+"""the days between consecutive amounts at each resolution, where that is fixed"""
+
+
+class DailySeries(NamedTuple):
+    """
+    an amount for every day from start_date, held densely so that a long range costs one array rather
+    than a Python object per day
+
+    start_date is None only when the series is empty and there was no date to start it from
+    """
+    start_date: datetime.date | None
+    amounts: np.ndarray
+    """
+    amounts[i] is the amount on start_date + i days, or at a coarser resolution, the average daily amount over
+    the i-th period from start_date, counting only the days of the period within the series' range
+    """
+    resolution: Resolution = "day"
+
+
+def get_daily_series(category: str | None = None,
+                     start_date: datetime.date | None = None,
+                     end_date: datetime.date | None = None) -> DailySeries:
+    rows = DB.get_transactions_for_category(category, start_date, end_date)
+    return fill_days(rows, start_date, end_date)
+
+
+async def get_daily_series_async(category: str | None = None,
+                                 start_date: datetime.date | None = None,
+                                 end_date: datetime.date | None = None) -> DailySeries:
+    """
+    get_daily_series, but querying the database without blocking the event loop
+    """
+    rows = await ADB.get_transactions_for_category(category, start_date, end_date)
+    return fill_days(rows, start_date, end_date)
+
+
+def get_daily_series_sql(category: str | None = None,
+                         start_date: datetime.date | None = None,
+                         end_date: datetime.date | None = None,
+                         avg_days: int | None = None) -> DailySeries:
+    """
+    get_daily_series, but with the missing days filled in by the database, along with the moving average
+    of average_amounts if avg_days is given, so that only the final series is sent back
+    """
+    rows = DB.get_transactions_series(category, start_date, end_date, avg_days)
+    return _series_from_rows(rows, start_date)
+
+
+async def get_daily_series_sql_async(category: str | None = None,
+                                     start_date: datetime.date | None = None,
+                                     end_date: datetime.date | None = None,
+                                     avg_days: int | None = None) -> DailySeries:
+    rows = await ADB.get_transactions_series(category, start_date, end_date, avg_days)
+    return _series_from_rows(rows, start_date)
+
+
+@timed("series_from_rows", rows=lambda series: len(series.amounts))
+def _series_from_rows(rows: list[Mapping], start_date: datetime.date | None) -> DailySeries:
+    """
+    turns the rows of get_transactions_series, which already have one row for every day, into a DailySeries
+    """
+    start = rows[0]["date"] if rows else start_date
+    return DailySeries(start, np.fromiter((row["amount"] for row in rows), dtype=np.float64, count=len(rows)))
+
+
+@timed("series_from_prefix_sums", rows=lambda series: len(series.amounts))
+def series_from_prefix_sums(prefix_sums: PrefixSums,
+                            category: str | None = None,
+                            start_date: datetime.date | None = None,
+                            end_date: datetime.date | None = None,
+                            avg_days: int | None = None) -> DailySeries:
+    """
+    the same series as get_daily_series, or as average_amounts of it if avg_days is given, sliced out of the
+    prefix sums rather than computed from the rows
+    """
+    bounds = prefix_sums.date_bounds(category)
+    if bounds is None and (start_date is None or end_date is None):
+        return DailySeries(start_date, np.zeros(0, dtype=np.float64))
+    start: datetime.date = start_date if start_date is not None else bounds[0]
+    end: datetime.date = end_date if end_date is not None else bounds[1]
+    return DailySeries(start, prefix_sums.averaged(category, start, end, avg_days or 0))
+
+
+@timed("series_from_daily_matrix", rows=lambda series: len(series.amounts))
+def series_from_daily_matrix(daily_matrix: DailyMatrix,
+                             category: str | None = None,
+                             start_date: datetime.date | None = None,
+                             end_date: datetime.date | None = None) -> DailySeries:
+    """
+    the same series as get_daily_series, sliced out of the daily matrix - without copying, where the range is
+    within the days it covers
+    """
+    bounds = daily_matrix.date_bounds(category)
+    if bounds is None and (start_date is None or end_date is None):
+        return DailySeries(start_date, np.zeros(0, dtype=np.float64))
+    start: datetime.date = start_date if start_date is not None else bounds[0]
+    end: datetime.date = end_date if end_date is not None else bounds[1]
+    return DailySeries(start, daily_matrix.daily(category, start, end))
+
+
+def get_period_series_sql(category: str | None = None,
+                          start_date: datetime.date | None = None,
+                          end_date: datetime.date | None = None,
+                          resolution: Resolution = "month") -> DailySeries:
+    """
+    downsample of get_daily_series, but with the amounts totalled over each period by the database
+    """
+    rows = DB.get_transactions_buckets(category, start_date, end_date, resolution)
+    return _series_from_buckets(rows, start_date, end_date, resolution)
+
+
+async def get_period_series_sql_async(category: str | None = None,
+                                      start_date: datetime.date | None = None,
+                                      end_date: datetime.date | None = None,
+                                      resolution: Resolution = "month") -> DailySeries:
+    rows = await ADB.get_transactions_buckets(category, start_date, end_date, resolution)
+    return _series_from_buckets(rows, start_date, end_date, resolution)
+
+
+@timed("series_from_buckets", rows=lambda series: len(series.amounts))
+def _series_from_buckets(rows: list[Mapping],
+                         start_date: datetime.date | None,
+                         end_date: datetime.date | None,
+                         resolution: Resolution) -> DailySeries:
+    """
+    turns the rows of get_transactions_buckets, which only has periods with transactions, into a series with every
+    period, dividing each total by the days of its period in the range
+    """
+    if not rows and (start_date is None or end_date is None):
+        return DailySeries(truncate(start_date, resolution) if start_date is not None else None,
+                           np.zeros(0, dtype=np.float64), resolution)
+    start: datetime.date = start_date if start_date is not None else rows[0]["first"]
+    end: datetime.date = end_date if end_date is not None else rows[-1]["last"]
+    if end < start:
+        return DailySeries(truncate(start, resolution), np.zeros(0, dtype=np.float64), resolution)
+
+    edges = bucket_edges(start, end, resolution)
+    # the rows are labelled by the first day of their period, which is the edge before them other than for the first
+    periods = np.concatenate([[np.datetime64(truncate(start, resolution), "D")], edges[1:-1]])
+    dates = np.array([row["date"] for row in rows], dtype="datetime64[D]")
+    totals = np.zeros(len(periods), dtype=np.float64)
+    totals[np.searchsorted(periods, dates)] = [row["amount"] for row in rows]
+    return DailySeries(truncate(start, resolution), totals / np.diff(edges).astype(np.int64), resolution)
+
+
+def period_series_from_prefix_sums(prefix_sums: PrefixSums,
+                                   category: str | None = None,
+                                   start_date: datetime.date | None = None,
+                                   end_date: datetime.date | None = None,
+                                   resolution: Resolution = "month") -> DailySeries:
+    """
+    downsample of get_daily_series, with the total of each period taken from the prefix sums, so that the work is
+    proportional to the number of periods rather than of days
+    """
+    bounds = prefix_sums.date_bounds(category)
+    if bounds is None and (start_date is None or end_date is None):
+        return DailySeries(truncate(start_date, resolution) if start_date is not None else None,
+                           np.zeros(0, dtype=np.float64), resolution)
+    start: datetime.date = start_date if start_date is not None else bounds[0]
+    end: datetime.date = end_date if end_date is not None else bounds[1]
+    if end < start:
+        return DailySeries(truncate(start, resolution), np.zeros(0, dtype=np.float64), resolution)
+
+    edges = bucket_edges(start, end, resolution)
+    ordinals = (edges - np.datetime64(start, "D")).astype(np.int64) + start.toordinal()
+    return DailySeries(truncate(start, resolution),
+                       prefix_sums.totals(category, ordinals) / np.diff(ordinals), resolution)
+
+
 def get_transactions_raw(category: str | None = None,
                          start_date: datetime.date | None = None,
                          end_date: datetime.date | None = None) -> list[Transaction]:
+    return to_transactions(get_daily_series(category, start_date, end_date))
+
+
+async def get_transactions_raw_async(category: str | None = None,
+                                     start_date: datetime.date | None = None,
+                                     end_date: datetime.date | None = None) -> list[Transaction]:
+    """
+    get_transactions_raw, but querying the database without blocking the event loop
+    """
+    return to_transactions(await get_daily_series_async(category, start_date, end_date))
 
-    transactions = DB.get_transactions_for_category(
-        category, start_date, end_date)
-    transactions = [Transaction(**row) for row in transactions.mappings()]
 
-    result: list[Transaction] = []
+@timed("fill_days", rows=lambda series: len(series.amounts))
+def fill_days(rows: Iterable[Mapping], start_date: datetime.date | None, end_date: datetime.date | None) -> DailySeries:
+    """
+    turns the rows of get_transactions_for_category, which are ordered by date, into an amount for every day
+    from start_date to end_date, where days without rows have an amount of 0
 
-    # starting at the earliest date in the transactions, and incrementing by one day until today
-    start: datetime.date = start_date if start_date is not None else transactions[0]["date"]
-    end: datetime.date = end_date if end_date is not None else transactions[-1]["date"]
+    a missing start_date or end_date is taken from the first or last row, and if there are no rows to take it
+    from the series is empty
+    """
+    rows = list(rows)
+    if not rows and (start_date is None or end_date is None):
+        return DailySeries(start_date, np.zeros(0, dtype=np.float64))
+    start: datetime.date = start_date if start_date is not None else rows[0]["date"]
+    end: datetime.date = end_date if end_date is not None else rows[-1]["date"]
 
-    date = start
-    i = 0
-    while date <= end:
-        if i >= len(transactions):
-            result.append({"date": date, "amount": 0})
-        elif date == transactions[i]["date"]:
-            result.append(transactions[i])
-            i += 1
-        else:
-            assert date < transactions[i]["date"]
-            result.append({"date": date, "amount": 0})
+    # every date becomes an index into the array, as its offset in days from the start
+    offset = start.toordinal()
+    days = np.fromiter((row["date"].toordinal() - offset for row in rows), dtype=np.int64, count=len(rows))
+    amounts = np.fromiter((row["amount"] for row in rows), dtype=np.float64, count=len(rows))
 
-        date += datetime.timedelta(days=1)
-    return result
+    result = np.zeros(max(0, end.toordinal() - offset + 1), dtype=np.float64)
+    result[days] = amounts
+    return DailySeries(start, result)
+
+
+def series_dates(series: DailySeries) -> list[datetime.date]:
+    if series.start_date is None:
+        return []
+    steps = np.arange(len(series.amounts))
+    match series.resolution:
+        case "day" | "week":
+            return (np.datetime64(series.start_date, "D") + STEP_DAYS[series.resolution] * steps).tolist()
+        case "month":
+            return (np.datetime64(series.start_date, "M") + steps).astype("datetime64[D]").tolist()
+        case "year":
+            return (np.datetime64(series.start_date, "Y") + steps).astype("datetime64[D]").tolist()
+
+
+def to_transactions(series: DailySeries) -> list[Transaction]:
+    return [{"date": date, "amount": amount} for date, amount in zip(series_dates(series), series.amounts.tolist())]
+
+
+def truncate(date: datetime.date, resolution: Resolution) -> datetime.date:
+    """
+    the first day of the period containing date, as with Postgres' date_trunc
+    """
+    match resolution:
+        case "day":
+            return date
+        case "week":
+            return date - datetime.timedelta(days=date.weekday())
+        case "month":
+            return date.replace(day=1)
+        case "year":
+            return date.replace(month=1, day=1)
+
+
+def bucket_edges(start_date: datetime.date, end_date: datetime.date, resolution: Resolution) -> np.ndarray:
+    """
+    returns: the first day of each period from start_date to end_date inclusive, except that the first period is
+    cut to begin at start_date, followed by the day after end_date - as datetime64[D], so np.diff gives the days
+    of the range in each period
+    """
+    first, last = np.datetime64(start_date, "D"), np.datetime64(end_date, "D")
+    match resolution:
+        case "day":
+            starts = np.arange(first + 1, last + 1)
+        case "week":
+            starts = np.arange(np.datetime64(truncate(start_date, "week"), "D") + 7, last + 1, 7)
+        case "month":
+            starts = np.arange(np.datetime64(start_date, "M") + 1, np.datetime64(end_date, "M") + 1).astype("datetime64[D]")
+        case "year":
+            starts = np.arange(np.datetime64(start_date, "Y") + 1, np.datetime64(end_date, "Y") + 1).astype("datetime64[D]")
+    return np.concatenate([[first], starts, [last + 1]])
+
+
+def auto_resolution(start_date: datetime.date, end_date: datetime.date, points: int) -> Resolution:
+    """
+    the finest resolution with at most points periods from start_date to end_date, or "year" if none has so few
+    """
+    for resolution in STEP_DAYS:
+        if len(bucket_edges(start_date, end_date, resolution)) - 1 <= points:
+            return resolution
+    return "year"
+
+
+@timed("downsample", rows=lambda series: len(series.amounts))
+def downsample(series: DailySeries, resolution: Resolution) -> DailySeries:
+    """
+    the average daily amount of a daily series over each period, so that a long range needs far fewer points
+    while keeping the scale of the daily amounts - and of any smoothing already applied to them
+
+    series.amounts may have a column for each of several series
+    """
+    if resolution == "day" or len(series.amounts) == 0:
+        start = truncate(series.start_date, resolution) if series.start_date is not None else None
+        return DailySeries(start, series.amounts, resolution)
+    start = series.start_date
+    end = start + datetime.timedelta(days=len(series.amounts) - 1)
+    offsets = (bucket_edges(start, end, resolution) - np.datetime64(start, "D")).astype(np.int64)
+    totals = np.add.reduceat(series.amounts, offsets[:-1], axis=0)
+    days = np.diff(offsets).reshape(-1, *[1] * (series.amounts.ndim - 1))
+    return DailySeries(truncate(start, resolution), totals / days, resolution)
+
+
+def _amounts(transactions: list[Transaction]) -> np.ndarray:
+    return np.fromiter((t["amount"] for t in transactions), dtype=np.float64, count=len(transactions))
+
+
+def _with_amounts(transactions: list[Transaction], amounts: np.ndarray) -> list[Transaction]:
+    return [{"date": t["date"], "amount": a} for t, a in zip(transactions, amounts.tolist())]
+
+
+@timed("average_amounts", rows=len)
+def average_amounts(amounts: np.ndarray, avg_days: int) -> np.ndarray:
+    """
+    moving average over a window of avg_days either side of each day, with days outside of the range counting as 0
+
+    amounts has a row for each day, and may have a column for each of several series
+    """
+    return math.correlate_window(amounts, math.box_kernel(2*avg_days+1), avg_days)
+
+
+@timed("smooth_amounts", rows=len)
+def smooth_amounts(amounts: np.ndarray, avg_days: int, kernel: SmoothingKernel = "bump") -> np.ndarray:
+    """
+    weighted average using the kernel (by default the bump function from math.convolve_smooth), with days outside
+    of the range counting as 0
+
+    amounts has a row for each day, and may have a column for each of several series
+    """
+    n = len(amounts)
+    if n == 0 or avg_days <= 0:
+        return amounts
+
+    match kernel:
+        case "bump":
+            # the window for day i spans [i - avg_days, i + avg_days), except for the last avg_days days
+            # where it spans [i - avg_days, i + avg_days] - this matches the original loop based implementation
+            smoothed_amounts = math.correlate_window(
+                amounts, math.bump_kernel(2*avg_days), avg_days)
+            tail = max(0, n - avg_days)
+            smoothed_amounts[tail:] = math.correlate_window(
+                amounts[max(0, tail - avg_days):], math.bump_kernel(2*avg_days+1), avg_days)[-(n - tail):]
+            return smoothed_amounts
+        case "ema":
+            # the weighting of pandas' ewm with a span of 2 * avg_days + 1
+            return math.exponential_moving_average(amounts, 1 / (avg_days + 1))
+        case _:
+            return math.correlate_window(amounts, math.kernel_weights(kernel, avg_days), avg_days)
 
 
 def get_transactions_averaged(transactions: list[Transaction], avg_days: int) -> list[Transaction]:
+    return _with_amounts(transactions, average_amounts(_amounts(transactions), avg_days))
+
+
+def get_transactions_smoothed(transactions: list[Transaction], avg_days: int,
+                              kernel: SmoothingKernel = "bump") -> list[Transaction]:
+    return _with_amounts(transactions, smooth_amounts(_amounts(transactions), avg_days, kernel))
+
+
+class TransactionSeries(TypedDict):
+    """
+    a series stored by column, where amounts[i] is the amount on start_date + i * step_days, or for months and
+    years (where step_days is None) on the first day of the i-th month or year from start_date
+    """
+    start_date: datetime.date | None
+    step_days: int | None
+    resolution: Resolution
+    amounts: list[float]
+
+
+def to_series(series: DailySeries) -> TransactionSeries:
+    return {"start_date": series.start_date,
+            "step_days": STEP_DAYS[series.resolution],
+            "resolution": series.resolution,
+            "amounts": series.amounts.tolist()}
+
+
+class TransactionsTable(TypedDict):
+    """
+    the daily amounts of several categories, stored by column
+    """
+    dates: list[datetime.date]
+    categories: list[str | None]
+    amounts: list[list[float]]
+    """amounts[i][j] is the amount in categories[i] on dates[j]"""
+
+
+@timed("pivot_transactions", rows=lambda pivot: len(pivot[2]))
+def pivot_transactions(rows: Iterable[Mapping],
+                       start_date: datetime.date | None,
+                       end_date: datetime.date | None) -> tuple[datetime.date, list[str | None], np.ndarray]:
+    """
+    turns the rows of get_transactions_groupby into a dense matrix with a row for every day and a column for every category
+
+    returns: the date of the first row, the category of each column, and the matrix
+    """
+    rows = list(rows)
+    categories = sorted({row["category_id"] for row in rows},
+                        key=lambda c: (c is None, c or ""))
+    if not rows and (start_date is None or end_date is None):
+        return start_date or end_date or datetime.date.today(), categories, np.zeros((0, 0))
+    start: datetime.date = start_date if start_date is not None else rows[0]["date"]
+    end: datetime.date = end_date if end_date is not None else rows[-1]["date"]
 
-    dates = [t["date"] for t in transactions]
-    amounts = [float(t["amount"]) for t in transactions]
+    column = {category: i for i, category in enumerate(categories)}
+    days = np.fromiter(((row["date"] - start).days for row in rows), dtype=np.int64, count=len(rows))
+    columns = np.fromiter((column[row["category_id"]] for row in rows), dtype=np.int64, count=len(rows))
+    amounts = np.fromiter((row["amount"] for row in rows), dtype=np.float64, count=len(rows))
 
-    averaged_amounts = [0.0] * len(dates)
-    for i in range(len(dates)):
-        for d in range(-avg_days, avg_days+1):
-            if 0 <= i + d < len(dates):
-                averaged_amounts[i + d] += amounts[i] / (2*avg_days+1)
+    # an end_date before start_date gives no days, as in fill_days
+    matrix = np.zeros((max(0, (end - start).days + 1), len(categories)), dtype=np.float64)
+    matrix[days, columns] = amounts
+    return start, categories, matrix
 
-    return [{"date": dates[i], "amount": averaged_amounts[i]} for i in range(len(dates))]
 
+async def get_transactions_table_async(start_date: datetime.date | None = None,
+                                       end_date: datetime.date | None = None,
+                                       smoothing: str | None = None,
+                                       avg_days: int = 7,
+                                       kernel: SmoothingKernel = "bump") -> TransactionsTable:
+    """
+    the daily amounts of every category, from one query, with the smoothing applied to every category at once
+    """
+    rows = await ADB.get_transactions_groupby(start_date, end_date)
+    start, categories, matrix = pivot_transactions(rows, start_date, end_date)
+    match smoothing:
+        case "averaged":
+            matrix = average_amounts(matrix, avg_days)
+        case "smoothed":
+            matrix = smooth_amounts(matrix, avg_days, kernel)
 
-def get_transactions_smoothed(transactions: list[Transaction], avg_days: int) -> list[Transaction]:
-    dates = [t["date"] for t in transactions]
-    amounts = [float(t["amount"]) for t in transactions]
+    return {"dates": [start + datetime.timedelta(days=i) for i in range(len(matrix))],
+            "categories": categories,
+            "amounts": matrix.T.tolist()}
 
-    n = len(dates)
-    smoothed_amounts = [0.0] * n
 
-    for i in range(n):
-        start = []
-        end = []
-        if i - avg_days < 0:
-            start = [0] * (avg_days - i)
-        if i + avg_days >= n:
-            end = [0] * (i + avg_days - n + 1)
-        mid = amounts[max(0, i - avg_days): min(n, i + avg_days)]
+class TransactionSeriesTable(TypedDict):
+    """
+    the columnar form of TransactionsTable, where amounts[i][j] is the amount in categories[i]
+    on start_date + j * step_days
+    """
+    start_date: datetime.date | None
+    step_days: int
+    categories: list[str | None]
+    amounts: list[list[float]]
 
-        smooth = math.convolve_smooth(start + mid + end)
-        smoothed_amounts[i] = smooth
 
-    return [{"date": dates[i], "amount": smoothed_amounts[i]} for i in range(n)]
+def to_series_table(table: TransactionsTable) -> TransactionSeriesTable:
+    return {"start_date": table["dates"][0] if table["dates"] else None,
+            "step_days": 1,
+            "categories": table["categories"],
+            "amounts": table["amounts"]}
@@ -0,0 +1,25 @@
+import datetime
+import random
+
+
+def random_rows(n: int, seed: int) -> list[dict]:
+    """
+    rows in the form of get_transactions_groupby, with at most one row for each day and category
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2024, 1, 1)
+    keys = {(start + datetime.timedelta(days=rng.randint(0, 200)), rng.choice(["fuel", "groceries", None]))
+            for _ in range(n)}
+    return [{"date": date, "category_id": category, "amount": round(rng.uniform(-150, 50), 2)}
+            for date, category in sorted(keys, key=lambda key: (key[0], key[1] or ""))]
+
+
+def category_rows(rows: list[dict], category: str | None) -> list[dict]:
+    """
+    the rows of get_transactions_for_category, summing every category if category is None
+    """
+    totals: dict[datetime.date, float] = {}
+    for row in rows:
+        if category is None or row["category_id"] == category:
+            totals[row["date"]] = totals.get(row["date"], 0) + row["amount"]
+    return [{"date": date, "amount": amount} for date, amount in sorted(totals.items())]
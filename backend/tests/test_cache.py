@@ -0,0 +1,43 @@
+import time
+import unittest
+from src.cache import LRUCache, ResponseCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ResponseCache(LRUCache(maxsize=10, ttl=60))
+        self.assertIsNone(cache.get(0, "a"))
+        cache.set(0, "a", [1])
+        self.assertListEqual(cache.get(0, "a"), [1])
+        self.assertDictEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1, "data_version": 0})
+
+    def test_new_data_version_invalidates(self):
+        cache = ResponseCache(LRUCache(maxsize=10, ttl=60))
+        cache.get(0, "a")
+        cache.set(0, "a", [1])
+        self.assertIsNone(cache.get(1, "a"))
+        # a value computed from the old data must not be cached once newer data has been seen
+        cache.set(0, "a", [1])
+        self.assertIsNone(cache.get(1, "a"))
+        self.assertEqual(cache.stats()["size"], 0)
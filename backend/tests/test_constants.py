@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+from src.constants import _load_suburb_index
+
+
+class TestSuburbIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.suburb_file = os.path.join(self.dir.name, "suburbs.csv")
+        self.cache_dir = os.path.join(self.dir.name, "cache")
+        self.write_suburbs(["Ultimo", "Epping (NSW)", "Wisemans Ferry"])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_suburbs(self, suburbs: list[str]):
+        with open(self.suburb_file, "w") as f:
+            f.write("Official Name Suburb;Official Name State\n")
+            for suburb in suburbs:
+                f.write(f"{suburb};New South Wales\n")
+
+    def test_cache_roundtrip(self):
+        built = _load_suburb_index(self.suburb_file, self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        cached = _load_suburb_index(self.suburb_file, self.cache_dir)
+        self.assertListEqual(cached.suburbs, ["Ultimo", "Epping", "Wisemans Ferry"])
+        self.assertSetEqual(cached.suburb_missing_set, built.suburb_missing_set)
+        self.assertTupleEqual(cached.suburb_matcher.search("cafe epping au"), (5, 11))
+
+    def test_cache_invalidated_by_new_file(self):
+        _load_suburb_index(self.suburb_file, self.cache_dir)
+        self.write_suburbs(["Cronulla"])
+        index = _load_suburb_index(self.suburb_file, self.cache_dir)
+        self.assertListEqual(index.suburbs, ["Cronulla"])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
@@ -0,0 +1,92 @@
+import datetime
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.daily_matrix import DailyMatrix
+from src.snapshot import SnapshotCache
+from src.transactions import series_from_daily_matrix
+from helpers import random_rows
+
+
+def import_into(cache_dir: str, rows: list[dict], data_version: int):
+    """
+    extends the saved matrix as an importing process would
+    """
+    cache = SnapshotCache(cache_dir, "postgresql://test")
+    daily_matrix = cache.get(DailyMatrix, data_version - 1)
+    daily_matrix.update(rows, data_version)
+    cache.save(daily_matrix)
+
+
+def read_series(cache_dir: str, category: str | None) -> tuple[int, list[float]]:
+    """
+    the saved data version and daily series of the category, as a server worker would read them
+    """
+    cache = SnapshotCache(cache_dir, "postgresql://test")
+    daily_matrix = cache.saved(DailyMatrix)
+    return daily_matrix.data_version, series_from_daily_matrix(daily_matrix, category).amounts.tolist()
+
+
+class TestDailyMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = random_rows(300, seed=0)
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = SnapshotCache(self.dir.name, "postgresql://test")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_slices_within_the_matrix(self):
+        daily_matrix = DailyMatrix.from_rows(self.rows, data_version=1)
+        first, last = daily_matrix.date_bounds("fuel")
+        series = series_from_daily_matrix(daily_matrix, "fuel")
+        self.assertEqual(series.start_date, first)
+        self.assertEqual(len(series.amounts), (last - first).days + 1)
+        self.assertTrue(np.shares_memory(series.amounts, daily_matrix.values))
+        self.assertFalse(series.amounts.flags.writeable)
+
+        # beyond the matrix, the days are padded with 0 in a copy
+        before = first - datetime.timedelta(days=3)
+        padded = daily_matrix.daily("fuel", before, last)
+        self.assertFalse(np.shares_memory(padded, daily_matrix.values))
+        np.testing.assert_array_equal(padded[:3], 0)
+        np.testing.assert_array_equal(padded[3:], series.amounts)
+
+    def test_loaded_matrix_is_memory_mapped(self):
+        self.cache.save(DailyMatrix.from_rows(self.rows, data_version=1))
+        loaded = DailyMatrix.load(self.cache.file(DailyMatrix))
+        self.assertIsInstance(loaded.values, np.memmap)
+        series = series_from_daily_matrix(loaded, None)
+        self.assertTrue(np.shares_memory(series.amounts, loaded.values))
+
+        # updating copies the mapped values, leaving the file as it was until the matrix is saved
+        saved = series.amounts.copy()
+        loaded.update([{**row, "amount": 1.0} for row in self.rows[:10]], 2)
+        self.assertNotIsInstance(loaded.values, np.memmap)
+        np.testing.assert_array_equal(series.amounts, saved)
+        reloaded = DailyMatrix.load(self.cache.file(DailyMatrix))
+        np.testing.assert_array_equal(series_from_daily_matrix(reloaded, None).amounts, saved)
+
+    def test_shared_between_processes(self):
+        self.cache.save(DailyMatrix.from_rows(self.rows, data_version=1))
+        mapped = DailyMatrix.load(self.cache.file(DailyMatrix))
+        self.assertIsInstance(mapped.values, np.memmap)
+        before = series_from_daily_matrix(mapped, "fuel").amounts
+        expected = before.tolist()
+        changed = [{**row, "amount": 1.0} for row in self.rows if row["category_id"] == "fuel"]
+
+        with ProcessPoolExecutor(1) as executor:
+            self.assertEqual(executor.submit(read_series, self.dir.name, "fuel").result(), (1, expected))
+            executor.submit(import_into, self.dir.name, changed, 2).result()
+            version, after = executor.submit(read_series, self.dir.name, "fuel").result()
+
+        self.assertEqual(version, 2)
+        self.assertEqual(sum(amount != 0 for amount in after), len(changed))
+        # the older version stays readable where it is mapped, though its file has been replaced
+        self.assertListEqual(before.tolist(), expected)
+        self.assertFalse(mapped.is_saved(self.cache.file(DailyMatrix)))
+        self.assertEqual(self.cache.saved(DailyMatrix).data_version, 2)
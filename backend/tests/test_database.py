@@ -0,0 +1,462 @@
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sql
+import sqlalchemy.dialects.postgresql as psql
+
+from src import cfg
+from src.constants import PARSE_RULES_VERSION
+from src.daily_matrix import DailyMatrix
+from src.database import AsyncDatabase, Database, DescriptionParse
+from src.metrics import collect_stages
+from src.prefix_sums import PrefixSums
+from src.snapshot import DailySnapshot
+from src.transactions import (Transaction, _series_from_buckets, downsample, fill_days, get_transactions_averaged,
+                              period_series_from_prefix_sums, series_from_prefix_sums, to_transactions)
+
+
+def write_statement(filename: str, n: int, seed: int = 0):
+    """
+    writes a bank statement csv with n rows spread over two years
+    """
+    rng = random.Random(seed)
+    merchants = ["WOOLWORTHS 1234 SYDNEY NS AUS", "COLES 0456 ULTIMO NSW AU", "CALTEX STAR EPPING AU",
+                 "Direct Debit 617704 PAYPAL AUSTRALIA 1033287233710", "TRANSPORTFORNSW TAP SYDNEY AUS",
+                 "Transfer to other Bank NetBank rent", "SOME CAFE CRONULLA NS AUS"]
+    start = datetime.date(2022, 1, 1)
+    balance = 1000.0
+    with open(filename, "w") as f:
+        for i in range(n):
+            date = start + datetime.timedelta(days=i * 730 // n)
+            description = rng.choice(merchants)
+            if rng.random() < 0.3:
+                value_date = date - datetime.timedelta(days=rng.randint(1, 3))
+                description += f" Card xx1234 Value Date: {value_date.strftime('%d/%m/%Y')}"
+            amount = round(rng.uniform(-150, 50), 2)
+            balance = round(balance + amount, 2)
+            f.write(f'{date.strftime("%d/%m/%Y")},"{amount:+.2f}","{description}","{balance:+.2f}"\n')
+
+
+class TestProcessRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, "statement.csv")
+        write_statement(self.filename, 200)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_matches_parsing_every_row(self):
+        df = Database.process_records(self.filename)
+        for row in df.itertuples():
+            raw = row.description_original.split("Value Date: ")[0].split("Card xx")[0]
+            description, location = Database.get_suburb_info(raw)
+            self.assertTupleEqual((row.description, row.location), (description, location))
+            self.assertTupleEqual((row.description_id, row.processed), Database.process_description(description))
+
+    def test_uses_given_parses(self):
+        parse = DescriptionParse("Cafe", "CRONULLA NS AUS", "Some Cafe", True)
+        df = Database.process_records(self.filename, {"SOME CAFE CRONULLA NS AUS": parse})
+        cafes = df[df["description_raw"] == "SOME CAFE CRONULLA NS AUS"]
+        self.assertGreater(len(cafes), 0)
+        self.assertTrue((cafes["description_id"] == "Some Cafe").all())
+
+
+@unittest.skipIf(cfg.settings.pg_test_connection_uri is None, "pg_test_connection_uri is not set")
+class DatabaseTestCase(unittest.TestCase):
+    """
+    recreates the test database and seeds it with a generated bank statement
+    """
+
+    rows = 3000
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(cfg.settings.pg_test_connection_uri)
+        cls.db.drop_all()
+        cls.db.initialise_empty_tables()
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, cls.rows)
+            cls.db.add_records(filename)
+        with cls.db.engine.begin() as conn:
+            conn.execute(sql.text("ANALYZE"))
+
+    def explain(self, query: sql.Select) -> str:
+        compiled = query.compile(dialect=psql.dialect(),
+                                 compile_kwargs={"literal_binds": True})
+        with self.db.engine.connect() as conn:
+            # with sequential scans disabled, a plan only contains one if no index can serve the query
+            conn.execute(sql.text("SET LOCAL enable_seqscan = off"))
+            plan = conn.execute(sql.text(f"EXPLAIN {compiled}"))
+            return "\n".join(row[0] for row in plan)
+
+
+class TestIndexes(DatabaseTestCase):
+
+    def test_transactions_for_category_uses_index(self):
+        for category in [None, "groceries"]:
+            query = self.db.select_transactions_for_category(
+                category, datetime.date(2022, 6, 1), datetime.date(2022, 6, 30))
+            self.assertNotIn("Seq Scan", self.explain(query))
+
+    def test_daily_category_refresh_uses_index(self):
+        query = self.db.select_daily_category(
+            [datetime.date(2022, 6, 1), datetime.date(2022, 6, 2)])
+        self.assertNotIn("Seq Scan on transaction", self.explain(query))
+
+    def test_migrate_adds_missing_indexes(self):
+        with self.db.engine.begin() as conn:
+            conn.execute(sql.text("DROP INDEX ix_transaction_coalesce_date"))
+        self.db.migrate()
+        indexes = sql.inspect(self.db.engine).get_indexes("transaction")
+        self.assertIn("ix_transaction_coalesce_date", [index["name"] for index in indexes])
+
+
+class TestDataVersion(DatabaseTestCase):
+
+    def test_add_records_bumps_data_version(self):
+        data_version = self.db.get_data_version()
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, 10, seed=1)
+            self.db.add_records(filename)
+        self.assertGreater(self.db.get_data_version(), data_version)
+
+
+class TestDailyCategory(DatabaseTestCase):
+
+    def rollup(self) -> list[tuple]:
+        daily = self.db.table_daily_category
+        with self.db.engine.connect() as conn:
+            return sorted(conn.execute(sql.select(daily.c["date"], daily.c["category_id"], daily.c["amount"])).all(),
+                          key=lambda row: (row[0], row[1] or ""))
+
+    def test_add_records_matches_full_refresh(self):
+        # overlaps the days already in the rollup, as well as adding new ones
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, 400, seed=4)
+            self.db.add_records(filename)
+        incremental = self.rollup()
+
+        with self.db.engine.begin() as conn:
+            self.db.refresh_daily_category(conn)
+        self.assertListEqual(incremental, self.rollup())
+
+    def test_refresh_without_delete_fails(self):
+        with self.assertRaises(sql.exc.IntegrityError):
+            with self.db.engine.begin() as conn:
+                conn.execute(sql.insert(self.db.table_daily_category).from_select(
+                    ["date", "category_id", "amount"], self.db.select_daily_category()))
+
+    def test_uncategorised_days_are_unique(self):
+        row = {"date": datetime.date(1990, 1, 1), "category_id": None, "amount": 1}
+        with self.assertRaises(sql.exc.IntegrityError):
+            with self.db.engine.begin() as conn:
+                conn.execute(sql.insert(self.db.table_daily_category), [row, row])
+
+
+class TestTransactionsSeries(DatabaseTestCase):
+
+    ranges = [(None, None),
+              (datetime.date(2021, 12, 1), datetime.date(2022, 2, 1)),
+              (datetime.date(2023, 6, 1), None),
+              (None, datetime.date(2022, 3, 1))]
+
+    def fill_days(self, category: str | None, start_date: datetime.date | None, end_date: datetime.date | None) -> list[Transaction]:
+        rows = self.db.get_transactions_for_category(category, start_date, end_date)
+        return to_transactions(fill_days(rows, start_date, end_date))
+
+    def test_matches_fill_days(self):
+        for category in [None, "groceries", "missing"]:
+            for start_date, end_date in self.ranges:
+                expected = self.fill_days(category, start_date, end_date)
+                rows = self.db.get_transactions_series(category, start_date, end_date)
+                self.assertListEqual([row["date"] for row in rows], [t["date"] for t in expected])
+                np.testing.assert_allclose([row["amount"] for row in rows], [t["amount"] for t in expected])
+
+    def test_matches_get_transactions_averaged(self):
+        # the sql and index executions of /transactions, which accepts any avg_days from 0
+        prefix_sums = self.db.get_prefix_sums()
+        for category in [None, "groceries"]:
+            for start_date, end_date in self.ranges:
+                for avg_days in [0, 1, 3, 28]:
+                    expected = get_transactions_averaged(self.fill_days(category, start_date, end_date), avg_days)
+                    rows = self.db.get_transactions_series(category, start_date, end_date, avg_days)
+                    indexed = to_transactions(series_from_prefix_sums(prefix_sums, category, start_date, end_date,
+                                                                      avg_days))
+                    for actual in [rows, indexed]:
+                        self.assertListEqual([t["date"] for t in actual], [t["date"] for t in expected])
+                        np.testing.assert_allclose([t["amount"] for t in actual],
+                                                   [t["amount"] for t in expected], atol=1e-9)
+
+    def test_periods_match_downsample(self):
+        prefix_sums = self.db.get_prefix_sums()
+        for category in [None, "groceries", "missing"]:
+            for start_date, end_date in self.ranges:
+                daily = fill_days(self.db.get_transactions_for_category(category, start_date, end_date),
+                                  start_date, end_date)
+                for resolution in ["week", "month", "year"]:
+                    expected = to_transactions(downsample(daily, resolution))
+                    rows = self.db.get_transactions_buckets(category, start_date, end_date, resolution)
+                    for series in [_series_from_buckets(rows, start_date, end_date, resolution),
+                                   period_series_from_prefix_sums(prefix_sums, category, start_date, end_date,
+                                                                  resolution)]:
+                        actual = to_transactions(series)
+                        self.assertListEqual([t["date"] for t in actual], [t["date"] for t in expected])
+                        np.testing.assert_allclose([t["amount"] for t in actual],
+                                                   [t["amount"] for t in expected], atol=1e-9)
+
+
+class TestLoaders(DatabaseTestCase):
+
+    def count_transactions(self) -> int:
+        with self.db.engine.connect() as conn:
+            return conn.execute(sql.select(sql.func.count()).select_from(self.db.table_transaction)).scalar_one()
+
+    def test_reimport_inserts_nothing(self):
+        data_version = self.db.get_data_version()
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, self.rows)
+            for loader in ["insert", "copy"]:
+                stats = self.db.add_records(filename, loader=loader)
+                self.assertEqual(stats["inserted"], 0)
+                self.assertEqual(stats["duplicates"], self.rows)
+        self.assertEqual(self.db.get_data_version(), data_version)
+
+    def test_drop_imported(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, self.rows)
+            records = Database.read_records(filename)
+            self.assertEqual(len(self.db._drop_imported(records)), 0)
+
+            write_statement(filename, 100, seed=4)
+            new_records = Database.read_records(filename)
+            kept = self.db._drop_imported(pd.concat([records.iloc[:100], new_records], ignore_index=True))
+            pd.testing.assert_frame_equal(kept.reset_index(drop=True), new_records)
+
+    def test_copy_matches_insert(self):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, 200, seed=3)
+            transactions = self.count_transactions()
+            stats = self.db.add_records(filename, chunksize=50, loader="copy")
+            self.assertEqual(self.count_transactions(), transactions + stats["inserted"])
+            self.assertEqual(stats["inserted"] + stats["duplicates"], 200)
+            self.assertGreater(stats["inserted"], 0)
+            self.assertEqual(self.db.add_records(filename, loader="insert")["inserted"], 0)
+        for stage in ["import.read_records", "import.process_records", "import.insert_records"]:
+            self.assertIn(stage, stats["stages"])
+
+        # the rollup was refreshed for the days copied in
+        with self.db.engine.connect() as conn:
+            expected = set(conn.execute(self.db.select_daily_category()).all())
+            actual = set(conn.execute(sql.select(*self.db.table_daily_category.columns)).all())
+        self.assertSetEqual(actual, expected)
+
+
+class TestImportFiles(DatabaseTestCase):
+
+    def snapshot(self) -> tuple[list[tuple], list[tuple]]:
+        """
+        every transaction, without its id, and every row of the rollup
+        """
+        transaction = self.db.table_transaction
+        with self.db.engine.connect() as conn:
+            transactions = conn.execute(sql.select(*[column for column in transaction.columns if column.name != "id"])
+                                        .order_by(transaction.c["id"])).all()
+            rollup = set(conn.execute(sql.select(*self.db.table_daily_category.columns)).all())
+        return transactions, rollup
+
+    def test_matches_add_records(self):
+        with tempfile.TemporaryDirectory() as dir:
+            paths = [os.path.join(dir, name) for name in ["a.csv", "b.csv", "c.csv"]]
+            write_statement(paths[0], 300, seed=5)
+            write_statement(paths[2], 100, seed=6)
+            with open(paths[0]) as f:
+                first = f.readlines()
+            with open(paths[2]) as f:
+                new = f.readlines()
+            # b overlaps the end of a, and c repeats b
+            with open(paths[1], "w") as f:
+                f.writelines(first[150:] + new)
+            with open(paths[2], "w") as f:
+                f.writelines(first[150:] + new)
+
+            self.db.drop_all()
+            self.db.initialise_empty_tables()
+            for path in paths:
+                self.db.add_records(path, chunksize=64)
+            expected = self.snapshot()
+
+            self.db.drop_all()
+            self.db.initialise_empty_tables()
+            stats = self.db.import_files(paths, max_workers=2, chunksize=64)
+            self.assertEqual(stats["inserted"], len(expected[0]))
+            self.assertEqual(stats["inserted"] + stats["duplicates"], 300 + 2 * 250)
+
+        transactions, rollup = self.snapshot()
+        self.assertListEqual(transactions, expected[0])
+        self.assertSetEqual(rollup, expected[1])
+
+
+class TestParseCache(DatabaseTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def filename(self) -> str:
+        filename = os.path.join(self.dir.name, "statement.csv")
+        write_statement(filename, self.rows)
+        return filename
+
+    def test_imports_cache_parses(self):
+        parses = self.db._load_parses()
+        df = Database.process_records(Database.read_records(self.filename()))
+        self.assertSetEqual(set(parses), set(df["description_raw"]))
+
+    def test_parses_of_chunk(self):
+        parses = self.db._load_parses()
+        records = Database.read_records(self.filename()).iloc[:3]
+        chunk_parses = Database._parses_of(records, parses)
+        self.assertSetEqual(set(chunk_parses), set(Database.process_records(records)["description_raw"]))
+        self.assertLess(len(chunk_parses), len(parses))
+
+    def test_parses_from_older_rules_are_dropped(self):
+        parse = self.db.table_description_parse
+        with self.db.engine.begin() as conn:
+            conn.execute(sql.insert(parse).values(raw="OLD", rules_version="older", description="OLD",
+                                                  location=None, description_id="Old", processed=False))
+        # loading only reads, leaving the cleanup to migrate
+        self.assertNotIn("OLD", self.db._load_parses())
+        self.db.migrate()
+        with self.db.engine.connect() as conn:
+            versions = conn.execute(sql.select(parse.c["rules_version"]).distinct()).scalars().all()
+        self.assertListEqual(versions, [PARSE_RULES_VERSION])
+
+
+class TestSnapshots(DatabaseTestCase):
+
+    def add_statement(self, seed: int):
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, "statement.csv")
+            write_statement(filename, 50, seed=seed)
+            self.db.add_records(filename)
+
+    def test_add_records_extends_saved_snapshots(self):
+        self.db.get_prefix_sums()
+        self.db.get_daily_matrix()
+        self.add_statement(seed=2)
+
+        data_version = self.db.get_data_version()
+        prefix_sums = PrefixSums.load(self.db.snapshots.file(PrefixSums))
+        daily_matrix = DailyMatrix.load(self.db.snapshots.file(DailyMatrix))
+        start, end = datetime.date(2021, 12, 1), datetime.date(2024, 2, 1)
+        for category in [None, "groceries"]:
+            expected = fill_days(self.db.get_transactions_for_category(category), start, end).amounts
+            for snapshot in [prefix_sums, daily_matrix]:
+                self.assertEqual(snapshot.data_version, data_version)
+                np.testing.assert_allclose(snapshot.daily(category, start, end), expected, atol=1e-9)
+
+    def test_add_records_removes_stale_snapshots(self):
+        self.db.snapshots.remove(PrefixSums)
+        self.db.snapshots.remove(DailyMatrix)
+        # an older daily matrix, as if an import had happened without updating it
+        DailyMatrix.from_rows([], self.db.get_data_version() - 1).save(self.db.snapshots.file(DailyMatrix))
+        self.add_statement(seed=3)
+        self.assertFalse(os.path.exists(self.db.snapshots.file(PrefixSums)))
+        self.assertFalse(os.path.exists(self.db.snapshots.file(DailyMatrix)))
+
+    def daily_matrix_stages(self) -> list[tuple[int, DailyMatrix, dict[str, float]]]:
+        """
+        the version, daily matrix and stages of two requests for it in a row, as the server makes them
+        """
+        async def fetch():
+            adb = AsyncDatabase(cfg.settings.pg_test_connection_uri)
+            try:
+                results = []
+                for _ in range(2):
+                    with collect_stages() as stages:
+                        version = await adb.get_daily_matrix_version()
+                        daily_matrix = await adb.get_daily_matrix(version)
+                    results.append((version, daily_matrix, stages))
+                return results
+            finally:
+                await adb.engine.dispose()
+
+        with mock.patch.object(cfg.settings, "data_version_ttl", 60):
+            return asyncio.run(fetch())
+
+    def test_daily_matrix_version_is_checked_against_the_database(self):
+        self.db.get_daily_matrix()
+        self.add_statement(seed=4)
+        data_version = self.db.get_data_version()
+
+        first, second = self.daily_matrix_stages()
+        for version, daily_matrix, _ in [first, second]:
+            self.assertEqual(version, data_version)
+            self.assertEqual(daily_matrix.data_version, version)
+        self.assertIn("db.get_data_version", first[2])
+        self.assertNotIn("db.get_transactions_groupby", first[2])
+        # within data_version_ttl, the database is not asked again
+        self.assertNotIn("db.get_data_version", second[2])
+
+    def test_stale_saved_daily_matrix_is_rebuilt(self):
+        # an older daily matrix, as if an import had committed without saving it
+        data_version = self.db.get_data_version()
+        DailyMatrix.from_rows([], data_version - 1).save(self.db.snapshots.file(DailyMatrix))
+
+        (version, daily_matrix, stages), _ = self.daily_matrix_stages()
+        self.assertEqual(version, data_version)
+        self.assertEqual(daily_matrix.data_version, data_version)
+        self.assertIn("db.get_transactions_groupby", stages)
+        self.assertEqual(DailySnapshot.saved_version(self.db.snapshots.file(DailyMatrix)), data_version)
+
+
+class TestAsyncDatabase(DatabaseTestCase):
+
+    def test_matches_database(self):
+        async def fetch():
+            adb = AsyncDatabase(cfg.settings.pg_test_connection_uri)
+            try:
+                return await asyncio.gather(adb.get_categories(),
+                                            adb.get_transactions_for_category(
+                                                "groceries", datetime.date(2022, 6, 1), datetime.date(2022, 8, 31)),
+                                            adb.get_transactions_groupby())
+            finally:
+                await adb.engine.dispose()
+
+        categories, transactions, groupby = asyncio.run(fetch())
+        self.assertListEqual(categories, self.db.get_categories())
+        self.assertListEqual(transactions, self.db.get_transactions_for_category(
+            "groceries", datetime.date(2022, 6, 1), datetime.date(2022, 8, 31)))
+        self.assertListEqual(groupby, self.db.get_transactions_groupby())
+
+    def test_rebuilds_snapshots(self):
+        self.db._forget_snapshots()
+
+        async def fetch():
+            adb = AsyncDatabase(cfg.settings.pg_test_connection_uri)
+            try:
+                return await asyncio.gather(adb.get_prefix_sums(), adb.get_daily_matrix())
+            finally:
+                await adb.engine.dispose()
+
+        for snapshot in asyncio.run(fetch()):
+            self.assertEqual(snapshot.data_version, self.db.get_data_version())
+            saved = type(snapshot).load(self.db.snapshots.file(type(snapshot)))
+            np.testing.assert_array_equal(saved.values, snapshot.values)
@@ -0,0 +1,48 @@
+import unittest
+from src.matching import DescriptionMatcher, SuburbMatcher, Trie
+
+
+class TestTrie(unittest.TestCase):
+
+    def test_leftmost_then_longest(self):
+        trie = Trie(["epping", "camp", "campbelltown"])
+        self.assertTupleEqual(trie.search("7fresh campbelltown7freshepping au"), (7, 19))
+
+    def test_no_match(self):
+        self.assertIsNone(Trie(["ultimo"]).search("netbank transfer"))
+
+    def test_longest_prefix_value(self):
+        trie = Trie()
+        trie.add("bp", "BP")
+        trie.add("bws", "BWS")
+        self.assertTupleEqual(trie.longest_prefix("bws 123"), (3, "BWS"))
+        self.assertIsNone(trie.longest_prefix("b"))
+
+
+class TestSuburbMatcher(unittest.TestCase):
+
+    def test_truncated_suffix(self):
+        matcher = SuburbMatcher([], ["Wiseman", "Wisemans Fer", "Wisemans Ferr"])
+        self.assertEqual(matcher.search_truncated_suffix("q khan wisemans ferr"), 7)
+        self.assertIsNone(matcher.search_truncated_suffix("q khan wisemans ferry"))
+
+
+class TestDescriptionMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = DescriptionMatcher({"BP": "Exact BP"},
+                                          {"BP", "BP Connect"},
+                                          {"bp c": "Dict BP", "Refund": "Refund"},
+                                          {r"Credit [0-9]+ Paypal": "Paypal", r"Direct": "Direct"})
+
+    def test_precedence(self):
+        self.assertEqual(self.matcher.match("BP"), "Exact BP")
+        self.assertEqual(self.matcher.match("bp connect 123"), "BP Connect")
+        self.assertEqual(self.matcher.match("BP Conn"), "BP")
+        self.assertEqual(self.matcher.match("Refund BP"), "Refund")
+
+    def test_regex_order(self):
+        # "Direct" matches further left, but the Paypal rule comes first
+        self.assertEqual(self.matcher.match("Direct Credit 123 PAYPAL"), "Paypal")
+        self.assertEqual(self.matcher.match("Direct Debit 123 PAYPAL"), "Direct")
+        self.assertIsNone(self.matcher.match("Woolworths"))
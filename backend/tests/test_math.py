@@ -0,0 +1,61 @@
+import unittest
+import warnings
+
+import numpy as np
+
+import src.math as math
+
+
+def correlate_reference(x: np.ndarray, kernel: np.ndarray, radius: int) -> np.ndarray:
+    padded = np.pad(x, [(radius, len(kernel))] + [(0, 0)] * (x.ndim - 1))
+    return np.array([np.tensordot(kernel, padded[i:i + len(kernel)], axes=1) for i in range(len(x))])
+
+
+class TestKernels(unittest.TestCase):
+
+    def test_normalised_and_symmetric(self):
+        for name in ["box", "bump", "gaussian", "triangular", "exponential"]:
+            for radius in [0, 1, 7, 90]:
+                kernel = math.kernel_weights(name, radius)
+                self.assertEqual(len(kernel), 2 * radius + 1)
+                self.assertAlmostEqual(kernel.sum(), 1)
+                np.testing.assert_allclose(kernel, kernel[::-1])
+                self.assertFalse(kernel.flags.writeable)
+
+    def test_bump_without_warnings(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            np.testing.assert_array_equal(math.bump(np.array([-1.0, 0.0, 1.0])), [0, np.exp(-1), 0])
+            for width in [1, 2, 3, 15]:
+                self.assertTrue(np.isfinite(math.bump_kernel(width)).all())
+            self.assertAlmostEqual(math.convolve_smooth([1.0, 1.0, 1.0]), 1)
+
+
+class TestCorrelateWindow(unittest.TestCase):
+
+    def test_matches_reference(self):
+        rng = np.random.default_rng(0)
+        # the wider kernels take the FFT path, in one dimension and in two
+        for width in [3, math.FFT_MIN_WIDTH_2D, math.FFT_MIN_WIDTH + 1]:
+            kernel = rng.random(width)
+            for x in [rng.normal(size=1000), rng.normal(size=(1000, 3))]:
+                for radius in [width // 2, width - 1]:
+                    np.testing.assert_allclose(math.correlate_window(x, kernel, radius),
+                                               correlate_reference(x, kernel, radius), atol=1e-9)
+
+
+class TestExponentialMovingAverage(unittest.TestCase):
+
+    def test_matches_recursion(self):
+        rng = np.random.default_rng(1)
+        x = rng.normal(size=(5000, 2))
+        for alpha in [1, 0.5, 0.01, 0.001]:
+            expected = np.zeros_like(x)
+            previous = np.zeros(2)
+            for i in range(len(x)):
+                previous = expected[i] = alpha * x[i] + (1 - alpha) * previous
+            np.testing.assert_allclose(math.exponential_moving_average(x, alpha), expected, atol=1e-9)
+            np.testing.assert_allclose(math.exponential_moving_average(x[:, 0], alpha), expected[:, 0], atol=1e-9)
+
+    def test_empty(self):
+        self.assertEqual(len(math.exponential_moving_average(np.zeros(0), 0.5)), 0)
@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+from src import metrics
+from src.metrics import Counter, Histogram, collect_stages, timed
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_render(self):
+        histogram = Histogram("latency_seconds", "latency", ("stage",), buckets=(0.1, 1))
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value, "query")
+        lines = histogram.render()
+        self.assertIn('latency_seconds_bucket{stage="query",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="query",le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{stage="query",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum{stage="query"} 2.65', lines)
+        self.assertIn('latency_seconds_count{stage="query"} 4', lines)
+
+    def test_escapes_labels(self):
+        counter = Counter("rows_total", "rows", ("path",))
+        counter.inc(3, 'a"b')
+        self.assertIn('rows_total{path="a\\"b"} 3', counter.render())
+
+
+class TestTimed(unittest.TestCase):
+
+    def setUp(self):
+        metrics.STAGE_SECONDS.clear()
+        metrics.STAGE_ROWS.clear()
+
+    def test_sync_and_async(self):
+        @timed("test.sync", rows=len)
+        def sync():
+            return [1, 2, 3]
+
+        @timed("test.async")
+        async def coroutine():
+            return sync()
+
+        with collect_stages() as stages:
+            self.assertListEqual(asyncio.run(coroutine()), [1, 2, 3])
+        self.assertSetEqual(set(stages), {"test.sync", "test.async"})
+        self.assertGreaterEqual(stages["test.async"], stages["test.sync"])
+
+        rendered = metrics.render()
+        self.assertIn('finance_stage_rows_total{stage="test.sync"} 3', rendered)
+        self.assertIn('finance_stage_seconds_count{stage="test.async"} 1', rendered)
+
+    def test_outside_of_collect_stages(self):
+        timed("test.sync")(lambda: None)()
+        self.assertIn('finance_stage_seconds_count{stage="test.sync"} 1', metrics.render())
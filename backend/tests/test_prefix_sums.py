@@ -0,0 +1,33 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from src.prefix_sums import PrefixSums
+from src.transactions import average_amounts, fill_days
+from helpers import category_rows, random_rows
+
+
+class TestPrefixSums(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = random_rows(300, seed=0)
+        self.start = datetime.date(2023, 12, 20)
+        self.end = datetime.date(2024, 8, 1)
+
+    def test_totals_and_averages(self):
+        prefix_sums = PrefixSums.from_rows(self.rows, data_version=1)
+        for category in [None, "fuel", "groceries", "missing"]:
+            expected = fill_days(category_rows(self.rows, category), self.start, self.end).amounts
+            self.assertAlmostEqual(prefix_sums.total(category, self.start, self.end), expected.sum())
+            for avg_days in [1, 7, 28]:
+                np.testing.assert_allclose(prefix_sums.averaged(category, self.start, self.end, avg_days),
+                                           average_amounts(expected, avg_days), atol=1e-9)
+
+            edges = np.array([self.start.toordinal(), self.start.toordinal() + 10, self.end.toordinal() + 1])
+            np.testing.assert_allclose(prefix_sums.totals(category, edges), [expected[:10].sum(), expected[10:].sum()])
+
+    def test_empty(self):
+        prefix_sums = PrefixSums.empty()
+        self.assertEqual(prefix_sums.total("fuel", self.start, self.end), 0)
+        np.testing.assert_array_equal(prefix_sums.averaged(None, self.start, self.end, 7), 0)
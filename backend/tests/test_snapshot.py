@@ -0,0 +1,101 @@
+import datetime
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.daily_matrix import DailyMatrix
+from src.prefix_sums import PrefixSums
+from src.snapshot import DailySnapshot, SnapshotCache
+from src.transactions import fill_days
+from helpers import category_rows, random_rows
+
+
+class TestDailySnapshot(unittest.TestCase):
+    """
+    the behaviour PrefixSums and DailyMatrix share, through the daily amounts each can give
+    """
+
+    kinds: list[type[DailySnapshot]] = [PrefixSums, DailyMatrix]
+
+    def setUp(self):
+        self.rows = random_rows(300, seed=0)
+        self.start = datetime.date(2023, 12, 20)
+        self.end = datetime.date(2024, 8, 1)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def assertMatchesRows(self, snapshot: DailySnapshot, rows: list[dict]):
+        for category in [None, "fuel", "groceries", "missing"]:
+            expected = fill_days(category_rows(rows, category), self.start, self.end).amounts
+            np.testing.assert_allclose(snapshot.daily(category, self.start, self.end), expected, atol=1e-9)
+
+    def test_from_rows(self):
+        for kind in self.kinds:
+            snapshot = kind.from_rows(self.rows, data_version=1)
+            self.assertMatchesRows(snapshot, self.rows)
+            self.assertEqual(len(snapshot), (self.rows[-1]["date"] - self.rows[0]["date"]).days + 1)
+            self.assertTupleEqual(snapshot.date_bounds(None), (self.rows[0]["date"], self.rows[-1]["date"]))
+            self.assertIsNone(snapshot.date_bounds("missing"))
+
+    def test_update_in_any_order(self):
+        chunks = [self.rows[i::4] for i in range(4)]
+        random.Random(1).shuffle(chunks)
+        for kind in self.kinds:
+            snapshot = kind.empty()
+            for version, chunk in enumerate(chunks, start=1):
+                snapshot.update(chunk, version)
+            self.assertMatchesRows(snapshot, self.rows)
+
+            # an update replaces the amounts of its days rather than adding to them
+            changed = [{**row, "amount": 1.0} for row in self.rows[:10]]
+            snapshot.update(changed, 5)
+            self.assertMatchesRows(snapshot, changed + self.rows[10:])
+            self.assertEqual(snapshot.data_version, 5)
+
+    def test_empty(self):
+        for kind in self.kinds:
+            snapshot = kind.empty()
+            self.assertIsNone(snapshot.date_bounds(None))
+            np.testing.assert_array_equal(snapshot.daily(None, self.start, self.start), [0])
+
+    def test_save_and_load(self):
+        for kind in self.kinds:
+            filename = os.path.join(self.dir.name, "cache", f"{kind.kind}.json")
+            self.assertIsNone(kind.load(filename))
+            kind.from_rows(self.rows, data_version=3).save(filename)
+            loaded = kind.load(filename)
+            self.assertEqual(loaded.data_version, 3)
+            self.assertEqual(DailySnapshot.saved_version(filename), 3)
+            self.assertMatchesRows(loaded, self.rows)
+
+            # saving a later version deletes the values of the earlier one
+            loaded.update(self.rows[:10], 4)
+            loaded.save(filename)
+            self.assertListEqual(sorted(os.listdir(os.path.dirname(filename))),
+                                 [f"{kind.kind}-4.npy", f"{kind.kind}.json"])
+            DailySnapshot.remove(filename)
+            self.assertListEqual(os.listdir(os.path.dirname(filename)), [])
+
+    def test_subclass_must_set_amounts(self):
+        class Incomplete(DailySnapshot):
+            kind = "incomplete"
+            dtype = np.float64
+
+        with self.assertRaises(TypeError):
+            Incomplete.empty()
+
+    def test_cache_keeps_newest_saved(self):
+        cache = SnapshotCache(self.dir.name, "postgresql://test")
+        cache.save(DailyMatrix.from_rows(self.rows, data_version=2))
+        # a reader rebuilding an older version does not save over the newer one
+        cache.save(DailyMatrix.from_rows(self.rows[:10], data_version=1))
+        self.assertEqual(DailySnapshot.saved_version(cache.file(DailyMatrix)), 2)
+        self.assertEqual(cache.get(DailyMatrix, 1).data_version, 1)
+        self.assertEqual(cache.get(DailyMatrix, 2).data_version, 2)
+        self.assertIsNone(cache.get(DailyMatrix, 3))
+        self.assertIsNone(cache.get(PrefixSums, 2))
@@ -0,0 +1,198 @@
+import datetime
+import unittest
+
+import numpy as np
+
+import src.math as math
+from src.transactions import (DailySeries, Transaction, auto_resolution, average_amounts, bucket_edges, downsample,
+                              fill_days, get_transactions_averaged, get_transactions_smoothed, pivot_transactions,
+                              smooth_amounts, to_series, to_series_table, to_transactions, truncate)
+from src.transactions import _amounts
+
+
+def averaged_reference(transactions: list[Transaction], avg_days: int) -> list[float]:
+    amounts = [float(t["amount"]) for t in transactions]
+    averaged_amounts = [0.0] * len(amounts)
+    for i in range(len(amounts)):
+        for d in range(-avg_days, avg_days+1):
+            if 0 <= i + d < len(amounts):
+                averaged_amounts[i + d] += amounts[i] / (2*avg_days+1)
+    return averaged_amounts
+
+
+def smoothed_reference(transactions: list[Transaction], avg_days: int) -> list[float]:
+    amounts = [float(t["amount"]) for t in transactions]
+    n = len(amounts)
+    smoothed_amounts = [0.0] * n
+    for i in range(n):
+        start = []
+        end = []
+        if i - avg_days < 0:
+            start = [0] * (avg_days - i)
+        if i + avg_days >= n:
+            end = [0] * (i + avg_days - n + 1)
+        mid = amounts[max(0, i - avg_days): min(n, i + avg_days)]
+        smoothed_amounts[i] = math.convolve_smooth(start + mid + end)
+    return smoothed_amounts
+
+
+def random_transactions(n: int, seed: int) -> list[Transaction]:
+    rng = np.random.default_rng(seed)
+    start = datetime.date(2024, 1, 1)
+    amounts = rng.normal(0, 50, n) * (rng.random(n) < 0.4)
+    return [{"date": start + datetime.timedelta(days=i), "amount": float(a)} for i, a in enumerate(amounts)]
+
+
+class TestTransactionsWindowing(unittest.TestCase):
+
+    def test_averaged_matches_reference(self):
+        for n in [1, 5, 30, 400]:
+            for avg_days in [0, 1, 7, 28]:
+                transactions = random_transactions(n, seed=n + avg_days)
+                result = get_transactions_averaged(transactions, avg_days)
+                self.assertListEqual([t["date"] for t in result], [
+                                     t["date"] for t in transactions])
+                np.testing.assert_allclose([t["amount"] for t in result],
+                                           averaged_reference(transactions, avg_days), atol=1e-9)
+
+    def test_smoothed_matches_reference(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for n in [1, 5, 30, 400]:
+                for avg_days in [2, 7, 28]:
+                    transactions = random_transactions(n, seed=n * avg_days)
+                    result = get_transactions_smoothed(transactions, avg_days)
+                    self.assertListEqual([t["date"] for t in result], [
+                                         t["date"] for t in transactions])
+                    np.testing.assert_allclose([t["amount"] for t in result],
+                                               smoothed_reference(transactions, avg_days), atol=1e-9)
+
+    def test_kernels_smooth_columns_separately(self):
+        amounts = np.column_stack([_amounts(random_transactions(400, seed=i)) for i in range(3)])
+        for kernel in ["bump", "gaussian", "triangular", "exponential", "ema"]:
+            smoothed = smooth_amounts(amounts, 7, kernel)
+            for column in range(3):
+                np.testing.assert_allclose(smoothed[:, column], smooth_amounts(amounts[:, column], 7, kernel),
+                                           atol=1e-9)
+            # a constant series stays constant away from the ends
+            np.testing.assert_allclose(smooth_amounts(np.ones(100), 7, kernel)[60:80], 1, rtol=1e-3)
+
+    def test_empty(self):
+        self.assertListEqual(get_transactions_averaged([], 7), [])
+        self.assertListEqual(get_transactions_smoothed([], 7), [])
+        self.assertListEqual(get_transactions_averaged([], 0), [])
+
+
+class TestTransactionsTable(unittest.TestCase):
+
+    def test_columns_match_single_series(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(0, 50, (200, 4))
+        for avg_days in [2, 7, 28]:
+            averaged = average_amounts(matrix, avg_days)
+            smoothed = smooth_amounts(matrix, avg_days)
+            for j in range(matrix.shape[1]):
+                np.testing.assert_allclose(averaged[:, j], average_amounts(matrix[:, j], avg_days), atol=1e-9)
+                np.testing.assert_allclose(smoothed[:, j], smooth_amounts(matrix[:, j], avg_days), atol=1e-9)
+
+    def test_pivot(self):
+        day = datetime.date(2024, 1, 1)
+        rows = [{"date": day, "category_id": "fuel", "amount": 1.0},
+                {"date": day, "category_id": None, "amount": 2.0},
+                {"date": day + datetime.timedelta(days=2), "category_id": "crypto", "amount": 3.0}]
+        start, categories, matrix = pivot_transactions(rows, None, day + datetime.timedelta(days=3))
+        self.assertEqual(start, day)
+        self.assertListEqual(categories, ["crypto", "fuel", None])
+        np.testing.assert_array_equal(matrix, [[0, 1, 2], [0, 0, 0], [3, 0, 0], [0, 0, 0]])
+
+    def test_pivot_end_before_start(self):
+        day = datetime.date(2024, 2, 1)
+        start, categories, matrix = pivot_transactions([], day, day - datetime.timedelta(days=31))
+        self.assertEqual(start, day)
+        self.assertTupleEqual(matrix.shape, (0, 0))
+        for avg_days in [0, 7]:
+            self.assertTupleEqual(average_amounts(matrix, avg_days).shape, (0, 0))
+            self.assertTupleEqual(smooth_amounts(matrix, avg_days).shape, (0, 0))
+
+
+class TestSeries(unittest.TestCase):
+
+    def test_fill_days(self):
+        day = datetime.date(2024, 1, 1)
+        rows = [{"date": day + datetime.timedelta(days=1), "amount": 1.5},
+                {"date": day + datetime.timedelta(days=3), "amount": -2.0}]
+        series = fill_days(rows, None, None)
+        self.assertEqual(series.start_date, day + datetime.timedelta(days=1))
+        np.testing.assert_array_equal(series.amounts, [1.5, 0, -2.0])
+
+        series = fill_days(rows, day, day + datetime.timedelta(days=5))
+        self.assertEqual(series.start_date, day)
+        np.testing.assert_array_equal(series.amounts, [0, 1.5, 0, -2.0, 0, 0])
+        self.assertListEqual(to_transactions(series)[:2], [{"date": day, "amount": 0.0},
+                                                           {"date": day + datetime.timedelta(days=1), "amount": 1.5}])
+
+    def test_fill_days_empty(self):
+        day = datetime.date(2024, 1, 1)
+        self.assertEqual(len(fill_days([], None, None).amounts), 0)
+        self.assertEqual(len(fill_days([], day, None).amounts), 0)
+        self.assertListEqual(to_transactions(fill_days([], None, None)), [])
+        np.testing.assert_array_equal(fill_days([], day, day + datetime.timedelta(days=2)).amounts, [0, 0, 0])
+
+    def test_to_series(self):
+        day = datetime.date(2024, 1, 1)
+        series = to_series(DailySeries(day, np.array([1.0, 0.0, 2.5])))
+        self.assertDictEqual(series, {"start_date": day, "step_days": 1, "resolution": "day",
+                                      "amounts": [1.0, 0.0, 2.5]})
+        self.assertDictEqual(to_series(DailySeries(None, np.zeros(0))),
+                             {"start_date": None, "step_days": 1, "resolution": "day", "amounts": []})
+        self.assertDictEqual(to_series(DailySeries(day, np.array([1.0]), "month")),
+                             {"start_date": day, "step_days": None, "resolution": "month", "amounts": [1.0]})
+
+    def test_to_series_table(self):
+        day = datetime.date(2024, 1, 1)
+        table = {"dates": [day, day + datetime.timedelta(days=1)], "categories": ["fuel", None],
+                 "amounts": [[1.0, 2.0], [3.0, 4.0]]}
+        self.assertDictEqual(to_series_table(table), {"start_date": day, "step_days": 1, "categories": ["fuel", None],
+                                                      "amounts": [[1.0, 2.0], [3.0, 4.0]]})
+
+
+class TestResolution(unittest.TestCase):
+
+    def test_bucket_edges(self):
+        edges = bucket_edges(datetime.date(2024, 1, 17), datetime.date(2024, 3, 4), "month")
+        self.assertListEqual(edges.tolist(), [datetime.date(2024, 1, 17), datetime.date(2024, 2, 1),
+                                              datetime.date(2024, 3, 1), datetime.date(2024, 3, 5)])
+        # 2024-01-17 is a Wednesday
+        edges = bucket_edges(datetime.date(2024, 1, 17), datetime.date(2024, 1, 29), "week")
+        self.assertListEqual(edges.tolist(), [datetime.date(2024, 1, 17), datetime.date(2024, 1, 22),
+                                              datetime.date(2024, 1, 29), datetime.date(2024, 1, 30)])
+
+    def test_downsample_matches_grouping_days(self):
+        start = datetime.date(2023, 11, 30)
+        amounts = np.random.default_rng(0).normal(0, 50, 500)
+        dates = to_transactions(DailySeries(start, amounts))
+        for resolution in ["day", "week", "month", "year"]:
+            groups: dict[datetime.date, list[float]] = {}
+            for t in dates:
+                groups.setdefault(truncate(t["date"], resolution), []).append(t["amount"])
+
+            series = downsample(DailySeries(start, amounts), resolution)
+            self.assertListEqual([t["date"] for t in to_transactions(series)], list(groups))
+            np.testing.assert_allclose(series.amounts, [np.mean(group) for group in groups.values()])
+
+        # each column of a matrix is downsampled separately
+        matrix = np.column_stack([amounts, -amounts])
+        np.testing.assert_allclose(downsample(DailySeries(start, matrix), "month").amounts[:, 1],
+                                   -downsample(DailySeries(start, amounts), "month").amounts)
+
+    def test_downsample_empty(self):
+        series = downsample(DailySeries(datetime.date(2024, 5, 5), np.zeros(0)), "month")
+        self.assertEqual(series.start_date, datetime.date(2024, 5, 1))
+        self.assertListEqual(to_transactions(series), [])
+        self.assertListEqual(to_transactions(downsample(DailySeries(None, np.zeros(0)), "year")), [])
+
+    def test_auto_resolution(self):
+        start = datetime.date(2020, 1, 1)
+        self.assertEqual(auto_resolution(start, datetime.date(2020, 12, 31), 1000), "day")
+        self.assertEqual(auto_resolution(start, datetime.date(2029, 12, 31), 1000), "week")
+        self.assertEqual(auto_resolution(start, datetime.date(2029, 12, 31), 200), "month")
+        self.assertEqual(auto_resolution(start, datetime.date(2029, 12, 31), 5), "year")